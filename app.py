@@ -1,9 +1,806 @@
 import os
 import datetime as dt
-from flask import Flask, request, abort, jsonify
+from functools import wraps
+from flask import Flask, Response, request, abort, jsonify, json, stream_with_context
 from flask_cors import CORS
-from models import setup_db, Actor, Movie
-from auth import AuthError, requires_auth
+from sqlalchemy import Float, cast, func, literal, select, tuple_, union_all
+from werkzeug.exceptions import HTTPException
+from models import (setup_db, db, format_columns, get_table_versions, insert_rows, update_row, update_rows, upsert_rows,
+                    select_existing_keys, delete_row, delete_rows, add_movie_actors, remove_movie_actor, movie_actors,
+                    get_stats, STATS_AGE_BUCKET, Actor, Movie)
+from auth import AuthError, has_permission, requires_auth
+from cache import ResponseCache, create_backend
+from metrics import init_metrics
+from profiling import init_profiling
+from read_models import get_row_type, row_columns, select_rows, fetch_rows, stream_rows
+from serialization import get_json_encoder
+
+# Number of objects in a page of a list endpoint if `limit` is not given
+DEFAULT_PAGE_SIZE = 100
+# Maximum number of objects in a page of a list endpoint
+MAX_PAGE_SIZE = 1000
+# Number of search results returned if `limit` is not given
+DEFAULT_SEARCH_LIMIT = 20
+# Maximum number of search results returned at once, and maximum offset into the results
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_OFFSET = 1000
+# Maximum number of objects created by one request to a bulk endpoint
+MAX_BULK_ROWS = 10000
+# Number of rows fetched per batch from the server side cursor when streaming a list endpoint
+STREAM_BATCH_SIZE = 1000
+
+
+def get_int_arg(name):
+    """Returns the query parameter `name` as an integer, or None if it is not given.
+
+    :raises HTTPException: 400 bad request if the parameter is not an integer.
+    """
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def get_page_args():
+    """Returns the keyset pagination query parameters `limit` and `after_id` as a tuple.
+    Returns (None, None) if neither is given, i.e. the whole table is requested.
+
+    :raises HTTPException: 400 bad request if a parameter is not an integer.
+        422 unprocessable if `limit` is not between 1 and `MAX_PAGE_SIZE`.
+    """
+    limit = get_int_arg('limit')
+    after_id = get_int_arg('after_id')
+    if limit is None and after_id is None:
+        return None, None
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        abort(422)
+    return limit, after_id
+
+
+def get_sort_arg(model, sortable):
+    """Returns the sort order in the query parameter `sort` as a tuple (expression, descending), or None if it is not
+    given. The parameter is a column name, prefixed with "-" for descending order.
+
+    :param sortable: Column names the model can be sorted by
+    :raises HTTPException: 400 bad request if the column can not be sorted by.
+    """
+    value = request.args.get('sort', None)
+    if value is None:
+        return None
+    descending = value.startswith('-')
+    name = value[1:] if descending else value
+    if name not in sortable:
+        abort(400)
+    expression = getattr(model, name)
+    # Sort NULL values as empty strings so they can be compared with the keyset cursor. The models index the same
+    # expression, e.g. `ix_actors_gender_sort`
+    if model.__table__.columns[name].nullable:
+        expression = func.coalesce(expression, '')
+    return expression, descending
+
+
+def order_query(statement, model, sort):
+    """Orders a select by the sort order from `get_sort_arg`, then by the primary key."""
+    if sort is None:
+        return statement.order_by(model.id)
+    expression, descending = sort
+    if descending:
+        return statement.order_by(expression.desc(), model.id.desc())
+    return statement.order_by(expression, model.id)
+
+
+def paginate(statement, model, row_type, limit, after_id, sort=None):
+    """Orders a select and returns one page of it using a keyset starting after the object with the id `after_id`.
+    The cost of a page is constant however deep the page is, unlike OFFSET.
+
+    If ordered by the primary key the keyset is `id > after_id`. Otherwise it is `(column, id) > (value, after_id)`,
+    where the value of the sorted column is looked up by primary key first.
+
+    :param row_type: Row type of the selected columns, e.g. from `get_row_type`
+    :param sort: Sort order from `get_sort_arg`, None to order by the primary key
+    :returns: A tuple (rows, next_cursor). `next_cursor` is the `after_id` of the next page, or None if this is
+        the last page.
+    :raises HTTPException: 400 bad request if sorted by a column and there is no object with the id `after_id`.
+    """
+    if after_id is not None:
+        if sort is None:
+            statement = statement.where(model.id > after_id)
+        else:
+            expression, descending = sort
+            after_row = db.session.execute(select([expression]).where(model.id == after_id)).first()
+            if after_row is None:
+                abort(400)
+            after_value = after_row[0]
+            if descending:
+                statement = statement.where(tuple_(expression, model.id) < tuple_(after_value, after_id))
+            else:
+                statement = statement.where(tuple_(expression, model.id) > tuple_(after_value, after_id))
+    # Fetch one extra row to know if there is a next page
+    objects = fetch_rows(order_query(statement, model, sort).limit(limit + 1), row_type)
+    if len(objects) > limit:
+        objects = objects[:limit]
+        return objects, objects[-1].id
+    return objects, None
+
+
+def get_stream_format():
+    """Returns the format a list endpoint should be streamed in: 'ndjson' if the client accepts
+    `application/x-ndjson`, 'json' if the query parameter `stream` is true, or None to not stream.
+    """
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def stream_query(statement, row_type, format_rows, stream_format):
+    """Streams the results of a select as a JSON array or newline delimited JSON.
+
+    Rows are read from a server side cursor in batches of `STREAM_BATCH_SIZE` and encoded one at a time, so memory
+    use and the time to the first byte do not grow with the number of rows.
+
+    :param statement: Select to stream
+    :param row_type: Row type of the selected columns, e.g. from `get_row_type`
+    :param format_rows: Function converting a list of rows to a list of JSON serializable objects, called once per
+        batch
+    :param stream_format: 'json' for a JSON array or 'ndjson' for one JSON object per line
+    """
+    batches = stream_rows(statement, row_type, STREAM_BATCH_SIZE)
+
+    def generate_objects():
+        for batch in batches:
+            yield from format_rows(batch)
+
+    def generate_json():
+        yield '['
+        separator = ''
+        for obj in generate_objects():
+            yield separator + json.dumps(obj, separators=(',', ':'))
+            separator = ','
+        yield ']\n'
+
+    def generate_ndjson():
+        for obj in generate_objects():
+            yield json.dumps(obj, separators=(',', ':')) + '\n'
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
+def get_fields_arg(model):
+    """Returns the column names in the comma separated query parameter `fields`, or None if it is not given.
+    The `id` column is always included.
+
+    :raises HTTPException: 400 bad request if a field is not a column of the model.
+    """
+    value = request.args.get('fields', None)
+    if value is None:
+        return None
+    # Repeated fields are returned once, in the order they are first given
+    fields = list(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    columns = model.__table__.columns
+    if not fields or any(f not in columns for f in fields):
+        abort(400)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def select_fields(model, fields):
+    """Returns a select of the model and the row type of its result rows, e.g. `ActorRow`.
+
+    If `fields` is given only those columns are selected. Rows are plain tuples instead of model objects, so reading
+    them does not add objects to the session.
+    """
+    row_type = get_row_type(model, None if fields is None else tuple(fields))
+    return select_rows(model, row_type), row_type
+
+
+# Related objects that can be included in the objects of a list endpoint with the query parameter `expand`, by
+# model and name: (related model, column of the link table referencing the model, column referencing the related
+# model, permission needed to view the related objects)
+EXPANSIONS = {
+    Movie: {'cast': (Actor, movie_actors.c.movie_id, movie_actors.c.actor_id, 'view:actors')},
+    Actor: {'movies': (Movie, movie_actors.c.actor_id, movie_actors.c.movie_id, 'view:movies')}
+}
+
+
+def get_expand_arg(model):
+    """Returns the related objects to include, named in the comma separated query parameter `expand`, as a dictionary
+    of the `EXPANSIONS` of the model by name.
+
+    :raises HTTPException: 400 bad request if a name is not an expansion of the model.
+    :raises AuthError: 403 if the token does not have the permission to view the related objects of an expansion.
+    """
+    value = request.args.get('expand', None)
+    if value is None:
+        return {}
+    names = [n.strip() for n in value.split(',') if n.strip()]
+    expansions = EXPANSIONS.get(model, {})
+    if not names or any(n not in expansions for n in names):
+        abort(400)
+    if not all(has_permission(expansions[n][3]) for n in names):
+        raise AuthError('permission not found', 403)
+    return {name: expansions[name] for name in names}
+
+
+def checks_expand_arg(model):
+    """Decorator validating the query parameter `expand` with `get_expand_arg` before the endpoint runs, so that
+    cached responses with related objects are not returned to tokens without the permission to view them.
+    """
+    def checks_expand_arg_decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            get_expand_arg(model)
+            return f(*args, **kwargs)
+        return decorated
+    return checks_expand_arg_decorator
+
+
+def load_related(expansion, ids):
+    """Loads the objects related to the objects with the ids with one query, instead of one query per object.
+
+    :param expansion: Tuple (related model, link column referencing the objects, link column referencing the related
+        model, permission), e.g. from `EXPANSIONS`
+    :returns: A dictionary of the lists of formatted related objects by id, ordered by id
+    """
+    related_model, key_column, related_column, _ = expansion
+    row_type = get_row_type(related_model)
+    related = {object_id: [] for object_id in ids}
+    if not ids:
+        return related
+    statement = select([key_column, *row_columns(related_model, row_type)]) \
+        .select_from(key_column.table.join(related_model.__table__, related_model.id == related_column)) \
+        .where(key_column.in_(ids)) \
+        .order_by(key_column, related_model.id)
+    for row in db.session.execute(statement):
+        related[row[0]].append(row_type._make(row[1:])._asdict())
+    return related
+
+
+def expand_objects(objects, expand):
+    """Adds the related objects of each expansion to a list of formatted objects, with one query per expansion.
+
+    :param expand: Dictionary of expansions by name, from `get_expand_arg`
+    :returns: The objects
+    """
+    for name, expansion in expand.items():
+        related = load_related(expansion, [obj['id'] for obj in objects])
+        for obj in objects:
+            obj[name] = related[obj['id']]
+    return objects
+
+
+def related_response(model, object_id, expansion):
+    """Builds the response of an endpoint listing the objects related to one object, e.g. the actors of a movie, with
+    one query.
+
+    :param expansion: Tuple (related model, link column referencing the model, link column referencing the related
+        model, permission), e.g. from `EXPANSIONS`
+    :returns: A JSON array of the related objects, ordered by id
+    :raises HTTPException: 404 not found if there is no object with the id.
+    """
+    related_model, key_column, related_column, _ = expansion
+    row_type = get_row_type(related_model)
+    # Outer joins return one row of nulls if the object exists but has no related objects
+    statement = select_rows(related_model, row_type) \
+        .select_from(model.__table__
+                     .outerjoin(key_column.table, key_column == model.id)
+                     .outerjoin(related_model.__table__, related_model.id == related_column)) \
+        .where(model.id == object_id) \
+        .order_by(related_model.id)
+    rows = fetch_rows(statement, row_type)
+    if not rows:
+        abort(404)
+    return jsonify([row._asdict() for row in rows if row.id is not None])
+
+
+def get_date_arg(name):
+    """Returns the query parameter `name` in the format "yyyy-mm-dd" as a date, or None if it is not given.
+
+    :raises HTTPException: 400 bad request if the parameter is not a date in the format "yyyy-mm-dd".
+    """
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return dt.date.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+
+def get_actor_filters():
+    """Returns the SQL criteria of the actor filter query parameters `age_min`, `age_max` and `gender`."""
+    criteria = []
+    age_min = get_int_arg('age_min')
+    age_max = get_int_arg('age_max')
+    gender = request.args.get('gender', None)
+    if age_min is not None:
+        criteria.append(Actor.age >= age_min)
+    if age_max is not None:
+        criteria.append(Actor.age <= age_max)
+    if gender is not None:
+        criteria.append(Actor.gender == gender)
+    return criteria
+
+
+def get_movie_filters():
+    """Returns the SQL criteria of the movie filter query parameters `release_date_from`, `release_date_to` and
+    `title_prefix`.
+    """
+    criteria = []
+    release_date_from = get_date_arg('release_date_from')
+    release_date_to = get_date_arg('release_date_to')
+    title_prefix = request.args.get('title_prefix', None)
+    if release_date_from is not None:
+        criteria.append(Movie.release_date >= release_date_from)
+    if release_date_to is not None:
+        criteria.append(Movie.release_date <= release_date_to)
+    if title_prefix:
+        criteria.append(Movie.title.startswith(title_prefix, autoescape=True))
+    return criteria
+
+
+def list_response(model, name, criteria=(), sortable=('id',)):
+    """Builds the response of the list endpoint of a model, handling the `fields`, `expand`, `sort`, pagination and
+    streaming query parameters. Related objects are loaded with one query per page, or per batch when streaming.
+
+    :param model: Model class to list
+    :param name: Name of the member of the array in paginated responses, e.g. 'actors'
+    :param criteria: SQL criteria to filter the model by
+    :param sortable: Column names the model can be sorted by
+    """
+    fields = get_fields_arg(model)
+    expand = get_expand_arg(model)
+    sort = get_sort_arg(model, sortable)
+    limit, after_id = get_page_args()
+    stream_format = get_stream_format()
+    statement, row_type = select_fields(model, fields)
+    for criterion in criteria:
+        statement = statement.where(criterion)
+
+    def format_rows(rows):
+        return expand_objects([row._asdict() for row in rows], expand)
+
+    if limit is None:
+        statement = order_query(statement, model, sort)
+        if stream_format:
+            return stream_query(statement, row_type, format_rows, stream_format)
+        return jsonify(format_rows(fetch_rows(statement, row_type)))
+    rows, next_cursor = paginate(statement, model, row_type, limit, after_id, sort)
+    return jsonify({
+        name: format_rows(rows),
+        'next': next_cursor
+    })
+
+
+def detail_response(model, object_id):
+    """Builds the response of the detail endpoint of a model, handling the `fields` query parameter.
+
+    :raises HTTPException: 404 not found if there is no object with the id.
+    """
+    fields = get_fields_arg(model)
+    statement, row_type = select_fields(model, fields)
+    rows = fetch_rows(statement.where(model.id == object_id).limit(1), row_type)
+    if not rows:
+        abort(404)
+    return jsonify(rows[0]._asdict())
+
+
+def search_query(model, column, result_type, q):
+    """Returns a select of the rows of a model where `column` contains the search string, with the columns `type`,
+    `id`, `text` and `rank`.
+
+    In PostgreSQL the rows are matched with ILIKE, which uses the pg_trgm GIN indexes of the models, and ranked by
+    trigram similarity. Other databases (e.g. SQLite in tests) fall back to a case insensitive LIKE ranked
+    by the fraction of the text matched.
+    """
+    # Escape the LIKE wildcards in the search string
+    pattern = '%' + q.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+    if db.engine.dialect.name == 'postgresql':
+        rank = func.similarity(column, q)
+    else:
+        rank = cast(len(q), Float) / func.length(column)
+    return select([
+        literal(result_type).label('type'),
+        model.id.label('id'),
+        column.label('text'),
+        rank.label('rank')
+    ]).where(column.ilike(pattern, escape='/'))
+
+
+def validate_actor(data):
+    """Validates the members of a new actor: name, age, gender. Age must be a positive integer.
+
+    :returns: A dictionary of the column values of the actor.
+    :raises HTTPException: 400 bad request if the data is missing a member or age is not an integer.
+        422 unprocessable if age is negative.
+    """
+    if not data or not isinstance(data, dict):
+        abort(400)
+    name = data.get('name', None)
+    age = data.get('age', None)
+    gender = data.get('gender', None)
+    # Raise bad request error if name or age data is not sent
+    if name is None or age is None:
+        abort(400)
+    # Raise bad request error if age is not an integer
+    if not isinstance(age, int):
+        abort(400)
+    # Raise unprocessable error if age is negative
+    if age < 0:
+        abort(422)
+    return {'name': name, 'age': age, 'gender': gender}
+
+
+def validate_movie(data):
+    """Validates the members of a new movie: title, release_date. Release date must be in the format "yyyy-mm-dd".
+
+    :returns: A dictionary of the column values of the movie.
+    :raises HTTPException: 400 bad request if the data is missing a member.
+        422 unprocessable if the release date is not in the format "yyyy-mm-dd".
+    """
+    if not data or not isinstance(data, dict):
+        abort(400)
+    title = data.get('title', None)
+    release_date = data.get('release_date', None)
+    # Raise bad request error if title or release_date data is not sent
+    if title is None or release_date is None:
+        abort(400)
+    # Convert date in "yyyy-mm-dd" format to a date object, raise unprocessable error if the format is wrong
+    try:
+        release_date = dt.date.fromisoformat(release_date)
+    except (TypeError, ValueError):
+        abort(422)
+    return {'title': title, 'release_date': release_date}
+
+
+def validate_actor_changes(data):
+    """Validates the changed members of an actor: at least one of name, age, gender. Age must be a positive integer.
+
+    :returns: A dictionary of the changed column values of the actor.
+    :raises HTTPException: 400 bad request if no member is given or age is not an integer.
+        422 unprocessable if age is negative.
+    """
+    if not data or not isinstance(data, dict):
+        abort(400)
+    name = data.get('name', None)
+    age = data.get('age', None)
+    gender = data.get('gender', None)
+    # Raise bad request error if all attributes are not given (must give at least one)
+    if name is None and age is None and gender is None:
+        abort(400)
+    if age is not None:
+        # Raise bad request error if age is not an integer
+        if not isinstance(age, int):
+            abort(400)
+        # Raise unprocessable error if age is negative
+        if age < 0:
+            abort(422)
+    values = {'name': name, 'age': age, 'gender': gender}
+    return {column: value for column, value in values.items() if value is not None}
+
+
+def validate_movie_changes(data):
+    """Validates the changed members of a movie: at least one of title, release_date. Release date must be in the
+    format "yyyy-mm-dd".
+
+    :returns: A dictionary of the changed column values of the movie.
+    :raises HTTPException: 400 bad request if no member is given.
+        422 unprocessable if the release date is not in the format "yyyy-mm-dd".
+    """
+    if not data or not isinstance(data, dict):
+        abort(400)
+    title = data.get('title', None)
+    release_date = data.get('release_date', None)
+    # Raise bad request error if all attributes are not given (must give at least one)
+    if title is None and release_date is None:
+        abort(400)
+    values = {}
+    if title is not None:
+        values['title'] = title
+    if release_date is not None:
+        # Convert date in "yyyy-mm-dd" format to a date object
+        try:
+            values['release_date'] = dt.date.fromisoformat(release_date)
+        except (TypeError, ValueError):
+            abort(422)
+    return values
+
+
+def get_ids_arg():
+    """Returns the ids in the comma separated query parameter `ids`.
+
+    :raises HTTPException: 400 bad request if the parameter is not given or is not a list of integers.
+        422 unprocessable if there are more than `MAX_BULK_ROWS` ids.
+    """
+    value = request.args.get('ids', '')
+    try:
+        ids = [int(i) for i in value.split(',') if i.strip()]
+    except ValueError:
+        abort(400)
+    if not ids:
+        abort(400)
+    if len(ids) > MAX_BULK_ROWS:
+        abort(422)
+    return ids
+
+
+def get_bulk_data():
+    """Returns the array of objects in the body of a bulk request, either a JSON array or newline delimited JSON if
+    the content type is `application/x-ndjson`. Lines of newline delimited JSON that can not be parsed are None.
+
+    :raises HTTPException: 400 bad request if the body is not an array.
+        422 unprocessable if the array has more than `MAX_BULK_ROWS` objects.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        data = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                data.append(json.loads(line))
+            except ValueError:
+                data.append(None)
+    else:
+        data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        abort(400)
+    if len(data) > MAX_BULK_ROWS:
+        abort(422)
+    return data
+
+
+def validate_rows(data, validate):
+    """Validates each object of a bulk request.
+
+    :param validate: Function validating one object, e.g. `validate_actor`
+    :returns: A tuple (rows, indexes, errors). `rows` are the column values of the valid objects and `indexes` their
+        indexes in the request. `errors` are JSON objects with the members `index`, `error` and `message` for each
+        invalid object.
+    """
+    rows = []
+    indexes = []
+    errors = []
+    for index, item in enumerate(data):
+        try:
+            rows.append(validate(item))
+            indexes.append(index)
+        except HTTPException as e:
+            errors.append({
+                'index': index,
+                'error': e.code,
+                'message': 'bad request' if e.code == 400 else 'unprocessable'
+            })
+    return rows, indexes, errors
+
+
+def remove_conflicts(model, rows, indexes):
+    """Removes the rows of a bulk request with the same natural key (`model.natural_key`) as an existing object, or
+    as an earlier row of the request.
+
+    :returns: A tuple (rows, indexes, errors) like `validate_rows`, with an error 409 conflict for each removed row.
+    """
+    keys = [tuple(row[key] for key in model.natural_key) for row in rows]
+    seen = select_existing_keys(model, set(keys))
+    kept_rows = []
+    kept_indexes = []
+    errors = []
+    for row, index, key in zip(rows, indexes, keys):
+        if key in seen:
+            errors.append({'index': index, 'error': 409, 'message': 'conflict'})
+        else:
+            seen.add(key)
+            kept_rows.append(row)
+            kept_indexes.append(index)
+    return kept_rows, kept_indexes, errors
+
+
+def bulk_create_response(model, validate, upsert=False):
+    """Builds the response of the bulk create endpoint of a model. Valid objects are inserted in one transaction.
+
+    :param upsert: If True, objects with the same natural key as an existing object (`model.natural_key`) update it
+        instead of being inserted. The results are then in the member `upserted` instead of `created`. Otherwise
+        those objects are errors, see `remove_conflicts`.
+    :raises HTTPException: 422 unprocessable if the valid objects can not be inserted, e.g. if a conflicting object
+        is created by another request at the same time.
+    """
+    rows, indexes, errors = validate_rows(get_bulk_data(), validate)
+    if not upsert:
+        rows, indexes, conflicts = remove_conflicts(model, rows, indexes)
+        errors = sorted(errors + conflicts, key=lambda error: error['index'])
+    try:
+        ids = upsert_rows(model, rows) if upsert else insert_rows(model, rows)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
+    return jsonify({
+        'upserted' if upsert else 'created': [
+            {'index': index, 'id': object_id} for index, object_id in zip(indexes, ids)
+        ],
+        'errors': errors
+    })
+
+
+def get_upsert_arg(permission):
+    """Returns True if the query parameter `upsert` is true.
+
+    :param permission: Permission needed to upsert in addition to the permission of the endpoint, e.g. 'update:actor'
+    :raises AuthError: 403 if upserting and the token does not have the permission.
+    """
+    upsert = request.args.get('upsert', '').lower() in ('1', 'true')
+    if upsert and not has_permission(permission):
+        raise AuthError('permission not found', 403)
+    return upsert
+
+
+def update_response(model, object_id, validate_changes):
+    """Builds the response of the update endpoint of a model. The object is updated and returned with one
+    `UPDATE ... RETURNING` statement, without loading it first.
+
+    :param validate_changes: Function validating the changes, e.g. `validate_actor_changes`
+    :returns: A JSON response of the updated object.
+    :raises HTTPException: 404 not found if there is no object with the id, even if the changes are invalid.
+        400 bad request or 422 unprocessable if the changes are invalid or can not be applied.
+    """
+    try:
+        values = validate_changes(request.get_json())
+    except HTTPException:
+        # Report a missing object before invalid changes
+        if db.session.query(model.id).filter(model.id == object_id).first() is None:
+            abort(404)
+        raise
+    # Raise unprocessable error if any error occurs during updating the object
+    try:
+        row = update_row(model, object_id, values)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
+    if row is None:
+        abort(404)
+    return jsonify(format_columns(row.keys(), row))
+
+
+def delete_response(model, object_id):
+    """Builds the response of the delete endpoint of a model, deleting the object with one
+    `DELETE ... RETURNING id` statement without loading it first.
+
+    :returns: A JSON response with the member `id`: the id of the deleted object.
+    :raises HTTPException: 404 not found if there is no object with the id.
+    """
+    try:
+        deleted_id = delete_row(model, object_id)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(500)
+    if deleted_id is None:
+        abort(404)
+    return jsonify({'id': deleted_id})
+
+
+def bulk_update_response(model, validate_changes):
+    """Builds the response of the bulk update endpoint of a model. Receives an array of objects with the members
+    `id` and `changes`. The valid changes are applied with one set based UPDATE statement per batch.
+
+    :param validate_changes: Function validating the changes of one object, e.g. `validate_actor_changes`
+    :raises HTTPException: 422 unprocessable if the valid changes can not be applied.
+    """
+    def validate(item):
+        if not isinstance(item, dict):
+            abort(400)
+        object_id = item.get('id', None)
+        if not isinstance(object_id, int) or isinstance(object_id, bool):
+            abort(400)
+        return object_id, validate_changes(item.get('changes', None))
+
+    items, indexes, errors = validate_rows(get_bulk_data(), validate)
+    changes = {}
+    for index, (object_id, values) in zip(indexes, items):
+        # Raise bad request error for the same id given more than once
+        if object_id in changes:
+            errors.append({'index': index, 'error': 400, 'message': 'bad request'})
+        else:
+            changes[object_id] = values
+    try:
+        updated = update_rows(model, changes)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
+    updated_ids = set(updated)
+    return jsonify({
+        'updated': sorted(updated_ids),
+        'missing': sorted(object_id for object_id in changes if object_id not in updated_ids),
+        'errors': sorted(errors, key=lambda error: error['index'])
+    })
+
+
+def bulk_delete_response(model):
+    """Builds the response of the bulk delete endpoint of a model, deleting the objects with the ids in the query
+    parameter `ids` with one DELETE statement per batch.
+
+    :raises HTTPException: 500 internal server error if the objects can not be deleted.
+    """
+    ids = get_ids_arg()
+    try:
+        deleted = delete_rows(model, ids)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(500)
+    deleted_ids = set(deleted)
+    return jsonify({
+        'deleted': sorted(deleted_ids),
+        'missing': sorted(set(ids) - deleted_ids)
+    })
+
+
+def stats_response():
+    """Builds the response of the statistics endpoint from the summary counters, without reading the actors and
+    movies tables.
+    """
+    stats = get_stats()
+    actors_total = stats['actors'].get('', 0)
+    by_gender = [{'gender': gender, 'count': count} for gender, count in sorted(stats['actors_gender'].items())]
+    without_gender = actors_total - sum(stats['actors_gender'].values())
+    if without_gender:
+        by_gender.append({'gender': None, 'count': without_gender})
+    return jsonify({
+        'actors': {
+            'total': actors_total,
+            'by_gender': by_gender,
+            'by_age': [
+                {'age_min': age, 'age_max': age + STATS_AGE_BUCKET - 1, 'count': count}
+                for age, count in sorted((int(bucket), count) for bucket, count in stats['actors_age'].items())
+            ]
+        },
+        'movies': {
+            'total': stats['movies'].get('', 0),
+            'by_release_year': [
+                {'year': year, 'count': count}
+                for year, count in sorted((int(bucket), count) for bucket, count in stats['movies_year'].items())
+            ]
+        }
+    })
+
+
+def add_movie_actors_response(movie_id):
+    """Builds the response of the endpoint casting actors in a movie. Receives a JSON object with the member
+    `actor_ids`: an array of actor ids.
+
+    :returns: A JSON response with the member `added`: the ids of the actors that were not already cast in the movie.
+    :raises HTTPException: 400 bad request if the body is invalid. 404 not found if there is no movie with the id.
+        422 unprocessable if an actor does not exist.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+    actor_ids = body.get('actor_ids', None)
+    if not isinstance(actor_ids, list) or not actor_ids or \
+            any(not isinstance(i, int) or isinstance(i, bool) for i in actor_ids):
+        abort(400)
+    if len(actor_ids) > MAX_BULK_ROWS:
+        abort(422)
+    if db.session.query(Movie.id).filter(Movie.id == movie_id).first() is None:
+        abort(404)
+    # Raise unprocessable error if an actor does not exist (foreign key violation)
+    try:
+        added = add_movie_actors(movie_id, actor_ids)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
+    return jsonify({'added': added})
 
 
 def create_app(test_config=None):
@@ -14,9 +811,21 @@ def create_app(test_config=None):
         setup_db(app)
     else:
         app.config['TESTING'] = True
-        # Use the test database if testing
-        setup_db(app, os.environ['TEST_DATABASE_URL'])
+        # Use the test database if testing. A dictionary test config can override the connection pool settings, and
+        # give the URLs of read replicas in the key `replica_urls`.
+        test_config = test_config if isinstance(test_config, dict) else {}
+        setup_db(app, os.environ['TEST_DATABASE_URL'], test_config, test_config.get('replica_urls', ()))
     CORS(app)
+    # JSON encoder of the responses, orjson by default if it is installed, see `JSON_PROVIDER`
+    app.json_encoder = get_json_encoder()
+    # Request counts and latencies by route, served at GET "/metrics"
+    init_metrics(app)
+    # cProfile profiles of a sample of the requests, only if `PROFILE_DIR` is set
+    init_profiling(app)
+    # Cache of the GET endpoints of actors and movies. The cache keys and ETags include the change counters of the
+    # tables, which are bumped by every change, so changes invalidate the caches of all workers
+    response_cache = ResponseCache(create_backend(), version_getter=get_table_versions)
+    app.response_cache = response_cache
 
     @app.route('/')
     def index():
@@ -28,27 +837,155 @@ def create_app(test_config=None):
 
     @app.route('/actors')
     @requires_auth("view:actors")
+    @checks_expand_arg(Actor)
+    @response_cache.cached("actors", "movies", "movie_actors", unless=get_stream_format)
     def get_actors():
         """GET "/actors" endpoint.
 
         Actor objects have members: `id`, `name`, `age`, `gender`.
+        Optional query parameters `limit` and `after_id` return one page of actors ordered by id.
+        All actors are streamed if the query parameter `stream` is true or the client accepts `application/x-ndjson`.
+        Optional query parameter `fields`, a comma separated list of members, only returns those members and `id`.
+        Optional query parameters `age_min`, `age_max` and `gender` filter the actors, and `sort` orders them by
+        `id`, `age` or `gender` (prefixed with "-" for descending order).
+        Optional query parameter `expand=movies` adds the member `movies` to each actor: the array of its movies,
+        which needs the permission `view:movies`.
 
-        :returns: An array of all actors in JSON format.
+        :returns: An array of all actors in JSON format. If paginated, a JSON object with the members `actors`: the
+            array of actors in the page, and `next`: the `after_id` of the next page or null if it is the last page.
         """
-        actors = Actor.query.order_by(Actor.id).all()
-        return jsonify([a.format() for a in actors])
+        return list_response(Actor, 'actors', get_actor_filters(), ('id', 'age', 'gender'))
 
     @app.route('/movies')
     @requires_auth("view:movies")
+    @checks_expand_arg(Movie)
+    @response_cache.cached("movies", "actors", "movie_actors", unless=get_stream_format)
     def get_movies():
         """GET "/movies" endpoint.
 
         Movie objects have members: `id`, `title`, `release_date`. Member `release_date` has the format `yyyy-mm-dd`.
+        Optional query parameters `limit` and `after_id` return one page of movies ordered by id.
+        All movies are streamed if the query parameter `stream` is true or the client accepts `application/x-ndjson`.
+        Optional query parameter `fields`, a comma separated list of members, only returns those members and `id`.
+        Optional query parameters `release_date_from`, `release_date_to` and `title_prefix` filter the movies, and
+        `sort` orders them by `id`, `title` or `release_date` (prefixed with "-" for descending order).
+        Optional query parameter `expand=cast` adds the member `cast` to each movie: the array of its actors,
+        which needs the permission `view:actors`.
 
-        :returns: An array of all movies in JSON format.
+        :returns: An array of all movies in JSON format. If paginated, a JSON object with the members `movies`: the
+            array of movies in the page, and `next`: the `after_id` of the next page or null if it is the last page.
         """
-        movies = Movie.query.order_by(Movie.id).all()
-        return jsonify([m.format() for m in movies])
+        return list_response(Movie, 'movies', get_movie_filters(), ('id', 'title', 'release_date'))
+
+    @app.route('/actors/<int:actor_id>')
+    @requires_auth("view:actors")
+    @response_cache.cached("actors")
+    def get_actor(actor_id):
+        """GET "/actors/<actor-id>" endpoint.
+
+        Optional query parameter `fields`, a comma separated list of members, only returns those members and `id`.
+
+        :returns: A JSON object representing the actor with members: id, name, age, gender.
+        :raises HTTPException: Raises 404 not found error if the actor does not exist.
+        """
+        return detail_response(Actor, actor_id)
+
+    @app.route('/movies/<int:movie_id>')
+    @requires_auth("view:movies")
+    @response_cache.cached("movies")
+    def get_movie(movie_id):
+        """GET "/movies/<movie-id>" endpoint.
+
+        Optional query parameter `fields`, a comma separated list of members, only returns those members and `id`.
+
+        :returns: A JSON object representing the movie with members: id, title, release_date.
+        :raises HTTPException: Raises 404 not found error if the movie does not exist.
+        """
+        return detail_response(Movie, movie_id)
+
+    @app.route('/movies/<int:movie_id>/actors')
+    @requires_auth(["view:movies", "view:actors"])
+    @response_cache.cached("movies", "actors", "movie_actors")
+    def get_movie_actors(movie_id):
+        """GET "/movies/<movie-id>/actors" endpoint.
+
+        :returns: An array of the actors cast in the movie, ordered by id.
+        :raises HTTPException: Raises 404 not found error if the movie does not exist.
+        """
+        return related_response(Movie, movie_id, EXPANSIONS[Movie]['cast'])
+
+    @app.route('/actors/<int:actor_id>/movies')
+    @requires_auth(["view:actors", "view:movies"])
+    @response_cache.cached("actors", "movies", "movie_actors")
+    def get_actor_movies(actor_id):
+        """GET "/actors/<actor-id>/movies" endpoint.
+
+        :returns: An array of the movies the actor is cast in, ordered by id.
+        :raises HTTPException: Raises 404 not found error if the actor does not exist.
+        """
+        return related_response(Actor, actor_id, EXPANSIONS[Actor]['movies'])
+
+    @app.route('/stats')
+    @requires_auth(["view:actors", "view:movies"])
+    @response_cache.cached("actors", "movies", "stat_counters")
+    def get_stats_summary():
+        """GET "/stats" endpoint.
+
+        The statistics are read from summary counters maintained by database triggers, so the cost does not grow
+        with the number of actors and movies.
+
+        :returns: A JSON object with the members `actors`: the `total` number of actors, and arrays of counts
+            `by_gender` and `by_age`, and `movies`: the `total` number of movies and an array of counts
+            `by_release_year`.
+        """
+        return stats_response()
+
+    @app.route('/search')
+    @requires_auth(any_of=["view:actors", "view:movies"])
+    def search():
+        """GET "/search" endpoint.
+
+        Search actor names and movie titles for the query parameter `q`. Only the types the user has the view
+        permission of are searched. Optional query parameters `limit` and `offset` page through the results.
+
+        :returns: A JSON object with the members `results`: an array of results ordered by rank with members `type`
+            ("actor" or "movie"), `id`, `name` or `title` and `rank`, and `next`: the `offset` of the next page or
+            null if it is the last page.
+        :raises HTTPException: 400 bad request if `q` is not given.
+            422 unprocessable if `limit` or `offset` is out of range.
+        """
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400)
+        limit = get_int_arg('limit')
+        offset = get_int_arg('offset') or 0
+        if limit is None:
+            limit = DEFAULT_SEARCH_LIMIT
+        if limit < 1 or limit > MAX_SEARCH_LIMIT or offset < 0 or offset > MAX_SEARCH_OFFSET:
+            abort(422)
+        queries = []
+        if has_permission('view:actors'):
+            queries.append(search_query(Actor, Actor.name, 'actor', q))
+        if has_permission('view:movies'):
+            queries.append(search_query(Movie, Movie.title, 'movie', q))
+        results = union_all(*queries).alias('results') if len(queries) > 1 else queries[0].alias('results')
+        statement = select([results]).order_by(
+            results.c.rank.desc(), results.c.type, results.c.id
+        ).limit(limit + 1).offset(offset)
+        rows = db.session.execute(statement).fetchall()
+        next_offset = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_offset = offset + limit
+        return jsonify({
+            'results': [{
+                'type': row.type,
+                'id': row.id,
+                'name' if row.type == 'actor' else 'title': row.text,
+                'rank': row.rank
+            } for row in rows],
+            'next': next_offset
+        })
 
     @app.route('/actors', methods=['POST'])
     @requires_auth("add:actor")
@@ -60,24 +997,10 @@ def create_app(test_config=None):
         :returns: A JSON object with the member `id`: the id of the newly created actor.
         :raises HTTPException: An appropriate HTTP exception.
         """
-        data = request.get_json()
-        if not data:
-            abort(400)
-        name = data.get('name', None)
-        age = data.get('age', None)
-        gender = data.get('gender', None)
-        # Raise bad request error if name or age data is not sent
-        if name is None or age is None:
-            abort(400)
-        # Raise bad request error if age is not an integer
-        if not isinstance(age, int):
-            abort(400)
-        # Raise unprocessable error if age is negative
-        if age < 0:
-            abort(422)
+        values = validate_actor(request.get_json())
         # Raise unprocessable error if any error occurs during adding the new actor to the database
         try:
-            new_actor = Actor(name, age, gender)
+            new_actor = Actor(**values)
             new_actor.insert()
             return jsonify({
                 'id': new_actor.id
@@ -96,19 +1019,10 @@ def create_app(test_config=None):
         :returns: A JSON object with the member `id`: the id of the newly created movie.
         :raises HTTPException: An appropriate HTTP exception.
         """
-        data = request.get_json()
-        if not data:
-            abort(400)
-        title = data.get('title', None)
-        release_date = data.get('release_date', None)
-        # Raise bad request error if title or release_date data is not sent
-        if title is None or release_date is None:
-            abort(400)
+        values = validate_movie(request.get_json())
         # Raise unprocessable error if any error occurs during adding the new movie to the database
         try:
-            # Convert date in "yyyy-mm-dd" format to a date object
-            release_date = dt.date.fromisoformat(release_date)
-            new_movie = Movie(title, release_date)
+            new_movie = Movie(**values)
             new_movie.insert()
             return jsonify({
                 'id': new_movie.id
@@ -117,6 +1031,107 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth("add:actor")
+    def post_actors_bulk():
+        """POST "/actors/bulk" endpoint.
+
+        Add many actors in one transaction. Receives a JSON array, or newline delimited JSON with the content type
+        `application/x-ndjson`, of objects with the same members as POST "/actors". Invalid objects are skipped and
+        reported.
+
+        If the query parameter `upsert` is true, actors with the same name as an existing actor update it instead.
+        This also requires the `update:actor` permission.
+
+        :returns: A JSON object with the members `created` (or `upserted`): an array of objects with the `index` of
+            each created actor in the request and its `id`, and `errors`: an array of objects with the `index` of each
+            invalid actor, and the `error` status code and `message` it would get from POST "/actors".
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_create_response(Actor, validate_actor, get_upsert_arg('update:actor'))
+
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth("add:movie")
+    def post_movies_bulk():
+        """POST "/movies/bulk" endpoint.
+
+        Add many movies in one transaction. Receives a JSON array, or newline delimited JSON with the content type
+        `application/x-ndjson`, of objects with the same members as POST "/movies". Invalid objects are skipped and
+        reported.
+
+        If the query parameter `upsert` is true, movies with the same title and release date as an existing movie
+        update it instead. This also requires the `update:movie` permission.
+
+        :returns: A JSON object with the members `created` (or `upserted`): an array of objects with the `index` of
+            each created movie in the request and its `id`, and `errors`: an array of objects with the `index` of each
+            invalid movie, and the `error` status code and `message` it would get from POST "/movies".
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_create_response(Movie, validate_movie, get_upsert_arg('update:movie'))
+
+    @app.route('/actors', methods=['PUT'])
+    @requires_auth(["add:actor", "update:actor"])
+    def put_actors():
+        """PUT "/actors" endpoint.
+
+        Add or update actors by name, so repeating a request does not create duplicates. Receives the same body as
+        POST "/actors/bulk". Actors with the same name as an existing actor update its age and gender.
+
+        :returns: A JSON object with the members `upserted`: an array of objects with the `index` of each actor in
+            the request and its `id`, and `errors`: an array of objects with the `index` of each invalid actor, and
+            the `error` status code and `message` it would get from POST "/actors".
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_create_response(Actor, validate_actor, upsert=True)
+
+    @app.route('/movies', methods=['PUT'])
+    @requires_auth(["add:movie", "update:movie"])
+    def put_movies():
+        """PUT "/movies" endpoint.
+
+        Add or update movies by title and release date, so repeating a request does not create duplicates. Receives
+        the same body as POST "/movies/bulk".
+
+        :returns: A JSON object with the members `upserted`: an array of objects with the `index` of each movie in
+            the request and its `id`, and `errors`: an array of objects with the `index` of each invalid movie, and
+            the `error` status code and `message` it would get from POST "/movies".
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_create_response(Movie, validate_movie, upsert=True)
+
+    @app.route('/movies/<int:movie_id>/actors', methods=['POST'])
+    @requires_auth("update:movie")
+    def post_movie_actors(movie_id):
+        """POST "/movies/<movie-id>/actors" endpoint.
+
+        Cast actors in a movie. Receives a JSON object with the member `actor_ids`: an array of actor ids. Actors
+        already cast in the movie are skipped.
+
+        :returns: A JSON object with the member `added`: the ids of the newly cast actors.
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return add_movie_actors_response(movie_id)
+
+    @app.route('/movies/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
+    @requires_auth("update:movie")
+    def delete_movie_actor(movie_id, actor_id):
+        """DELETE "/movies/<movie-id>/actors/<actor-id>" endpoint.
+
+        Remove an actor from the cast of a movie. The actor is not deleted.
+
+        :returns: A JSON object with the members `movie_id` and `actor_id`.
+        :raises HTTPException: Raises 404 not found error if the actor is not cast in the movie.
+        """
+        try:
+            removed = remove_movie_actor(movie_id, actor_id)
+        except Exception as e:
+            print(e)
+            db.session.rollback()
+            abort(500)
+        if not removed:
+            abort(404)
+        return jsonify({'movie_id': movie_id, 'actor_id': actor_id})
+
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth("update:actor")
     def patch_actor(actor_id):
@@ -127,38 +1142,7 @@ def create_app(test_config=None):
         :returns: A JSON object representing the updated actor with members: id, name, age, gender.
         :raises HTTPException: An appropriate HTTP exception.
         """
-        actor = Actor.query.get(actor_id)
-        if not actor:
-            abort(404)
-        data = request.get_json()
-        if not data:
-            abort(400)
-        name = data.get('name', None)
-        age = data.get('age', None)
-        gender = data.get('gender', None)
-        # Raise bad request error if all attributes are not given (must give at least one)
-        if name is None and age is None and gender is None:
-            abort(400)
-        if age is not None:
-            # Raise bad request error if age is not an integer
-            if not isinstance(age, int):
-                abort(400)
-            # Raise unprocessable error if age is negative
-            if age < 0:
-                abort(422)
-        # Raise unprocessable error if any error occurs during updating the actor
-        try:
-            if name is not None:
-                actor.name = name
-            if age is not None:
-                actor.age = age
-            if gender is not None:
-                actor.gender = gender
-            actor.update()
-            return jsonify(actor.format())
-        except Exception as e:
-            print(e)
-            abort(422)
+        return update_response(Actor, actor_id, validate_actor_changes)
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth("update:movie")
@@ -170,29 +1154,65 @@ def create_app(test_config=None):
         :returns: A JSON object representing the updated movie with members: id, title, release_date.
         :raises HTTPException: An appropriate HTTP exception.
         """
-        movie = Movie.query.get(movie_id)
-        if not movie:
-            abort(404)
-        data = request.get_json()
-        if not data:
-            abort(400)
-        title = data.get('title', None)
-        release_date = data.get('release_date', None)
-        # Raise bad request error if all attributes are not given (must give at least one)
-        if title is None and release_date is None:
-            abort(400)
-        # Raise unprocessable error if any error occurs during updating the actor
-        try:
-            if title is not None:
-                movie.title = title
-            if release_date is not None:
-                # Convert date in "yyyy-mm-dd" format to a date object
-                movie.release_date = dt.date.fromisoformat(release_date)
-            movie.update()
-            return jsonify(movie.format())
-        except Exception as e:
-            print(e)
-            abort(422)
+        return update_response(Movie, movie_id, validate_movie_changes)
+
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth("update:actor")
+    def patch_actors():
+        """PATCH "/actors" endpoint.
+
+        Updates many actors. Receives a JSON array of objects with the members `id`: the id of the actor, and
+        `changes`: an object with the same members as PATCH "/actors/<actor-id>". Invalid objects are skipped and
+        reported.
+
+        :returns: A JSON object with the members `updated`: the ids of the updated actors, `missing`: the ids of
+            actors that do not exist, and `errors`: an array of objects with the `index` of each invalid object in the
+            request, and the `error` status code and `message`.
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_update_response(Actor, validate_actor_changes)
+
+    @app.route('/movies', methods=['PATCH'])
+    @requires_auth("update:movie")
+    def patch_movies():
+        """PATCH "/movies" endpoint.
+
+        Updates many movies. Receives a JSON array of objects with the members `id`: the id of the movie, and
+        `changes`: an object with the same members as PATCH "/movies/<movie-id>". Invalid objects are skipped and
+        reported.
+
+        :returns: A JSON object with the members `updated`: the ids of the updated movies, `missing`: the ids of
+            movies that do not exist, and `errors`: an array of objects with the `index` of each invalid object in the
+            request, and the `error` status code and `message`.
+        :raises HTTPException: An appropriate HTTP exception.
+        """
+        return bulk_update_response(Movie, validate_movie_changes)
+
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth("delete:actor")
+    def delete_actors():
+        """Delete "/actors" endpoint.
+
+        Delete the actors with the ids in the comma separated query parameter `ids`, e.g. "/actors?ids=1,2,3".
+
+        :returns: A JSON object with the members `deleted`: the ids of the deleted actors, and `missing`: the ids of
+            actors that do not exist.
+        :raises HTTPException: Raises 400 bad request error if the ids are missing or not integers.
+        """
+        return bulk_delete_response(Actor)
+
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth("delete:movie")
+    def delete_movies():
+        """Delete "/movies" endpoint.
+
+        Delete the movies with the ids in the comma separated query parameter `ids`, e.g. "/movies?ids=1,2,3".
+
+        :returns: A JSON object with the members `deleted`: the ids of the deleted movies, and `missing`: the ids of
+            movies that do not exist.
+        :raises HTTPException: Raises 400 bad request error if the ids are missing or not integers.
+        """
+        return bulk_delete_response(Movie)
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth("delete:actor")
@@ -204,15 +1224,7 @@ def create_app(test_config=None):
         :returns: The id of the deleted actor.
         :raises HTTPException: Raises 404 not found error if the actor does not exist.
         """
-        actor = Actor.query.get(actor_id)
-        if not actor:
-            abort(404)
-        try:
-            actor.delete()
-            return jsonify({'id': actor.id})
-        except Exception as e:
-            print(e)
-            abort(500)
+        return delete_response(Actor, actor_id)
 
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth("delete:movie")
@@ -224,15 +1236,7 @@ def create_app(test_config=None):
         :returns: The id of the deleted movie.
         :raises HTTPException: Raises 404 not found error if the movie does not exist.
         """
-        movie = Movie.query.get(movie_id)
-        if not movie:
-            abort(404)
-        try:
-            movie.delete()
-            return jsonify({'id': movie.id})
-        except Exception as e:
-            print(e)
-            abort(500)
+        return delete_response(Movie, movie_id)
 
     @app.errorhandler(400)
     def error_400(error):
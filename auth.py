@@ -1,13 +1,44 @@
 import os
+from collections import OrderedDict, namedtuple
 from functools import wraps
+import hashlib
 import json
+import logging
+import threading
+import time
 from urllib.request import urlopen
 from jose import jwt
 from flask import request, _request_ctx_stack
 
+logger = logging.getLogger(__name__)
+
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 API_AUDIENCE = os.environ['AUTH0_API_AUDIENCE']
 ALGORITHMS = ['RS256']
+# URL of the JSON Web Key Set, defaults to the one of the Auth0 domain. Can point to a local key set, e.g. in benchmarks
+AUTH0_JWKS_URL = os.environ.get('AUTH0_JWKS_URL', 'https://' + AUTH0_DOMAIN + '/.well-known/jwks.json')
+# Seconds before the cached JWKS is considered stale and refreshed in the background
+JWKS_CACHE_TTL = float(os.environ.get('JWKS_CACHE_TTL', 600))
+# Minimum seconds between refetches triggered by tokens with an unknown key id
+JWKS_MIN_REFRESH_INTERVAL = float(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+# Maximum number of verified tokens kept in memory, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+# Callables receiving the name of each cache event (e.g. 'token_cache.hit'), used to export instrumentation
+instrumentation_hooks = []
+# Callables receiving the name and duration in seconds of each timed step of token verification: 'auth.jwks' (key
+# lookup, including fetching the key set) and 'auth.verify' (signature and claims check)
+timing_hooks = []
+
+
+def _emit(event):
+    for hook in instrumentation_hooks:
+        hook(event)
+
+
+def _emit_timing(name, seconds):
+    for hook in timing_hooks:
+        hook(name, seconds)
 
 
 # Error handler
@@ -18,6 +49,211 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSKeyStore:
+    """In-process cache of the Auth0 JSON Web Key Set, keyed by key id (`kid`).
+
+    The key set is fetched on first use and then served from memory. Once it is older than `ttl` seconds the stale
+    keys keep being served while a background thread refreshes them. A token with an unknown `kid` triggers one
+    blocking refetch. Fetches are attempted at most once every `min_refresh_interval` seconds, so invalid tokens
+    can't force refetches and a failing refresh is not retried by every request.
+    """
+
+    def __init__(self, url, ttl=JWKS_CACHE_TTL, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._last_fetch_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # Callables called without arguments when the key set changes
+        self.rotation_listeners = []
+
+    def fetch(self):
+        """Downloads the key set. Returns a dictionary of RSA keys by key id."""
+        jsonurl = urlopen(self.url)
+        jwks = json.loads(jsonurl.read())
+        keys = {}
+        for key in jwks['keys']:
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+        return keys
+
+    def refresh(self):
+        """Fetches the key set and replaces the cached keys. The cached keys are kept if the fetch fails.
+
+        :returns: True if the keys were refreshed successfully
+        """
+        with self._lock:
+            self._last_fetch_attempt = time.monotonic()
+        try:
+            keys = self.fetch()
+        except Exception as e:
+            logger.warning('fetching the key set from %s failed: %s', self.url, e)
+            with self._lock:
+                self.fetch_errors += 1
+                self._refreshing = False
+            return False
+        with self._lock:
+            rotated = bool(self._keys) and keys.keys() != self._keys.keys()
+            self.fetches += 1
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self._refreshing = False
+        if rotated:
+            for listener in self.rotation_listeners:
+                listener()
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def _can_refetch(self, now):
+        last = self._last_fetch_attempt
+        return last is None or now - last >= self.min_refresh_interval
+
+    def get_key(self, kid):
+        """Returns the RSA key with the given key id, or None if the key set does not contain it."""
+        now = time.monotonic()
+        if self._fetched_at is None:
+            if self._can_refetch(now):
+                self.refresh()
+        elif now - self._fetched_at > self.ttl and self._can_refetch(now):
+            # Serve the stale keys while they are refreshed
+            self._refresh_in_background()
+        key = self._keys.get(kid)
+        if key is None and self._fetched_at is not None and self._can_refetch(now):
+            # The keys may have been rotated, refetch once
+            self.refresh()
+            key = self._keys.get(kid)
+        if key is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key
+
+    def stats(self):
+        """Returns a dictionary of the cache counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'fetches': self.fetches,
+            'fetch_errors': self.fetch_errors,
+            'keys': len(self._keys)
+        }
+
+
+# A verified JWT payload with its permissions claim as a frozenset, or None if the claim is missing
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions'])
+
+
+def get_permissions(payload):
+    """Returns the permissions claim of a decoded JWT payload as a frozenset, or None if it has no permissions."""
+    permissions = payload.get('permissions')
+    if permissions is None:
+        return None
+    return frozenset(permissions)
+
+
+class TokenCache:
+    """LRU cache of verified tokens, keyed by the SHA-256 hash of the token.
+
+    Entries are dropped once the token's `exp` claim has passed, so a cached token is never accepted after it expires.
+    Tokens without an `exp` claim are not cached.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """Returns the cached `VerifiedToken` of the token, or None if the token is not cached or has expired."""
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                verified, exp = entry
+                if exp > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    event = 'token_cache.hit'
+                else:
+                    del self._entries[key]
+                    verified = None
+                    self.expirations += 1
+                    self.misses += 1
+                    event = 'token_cache.expired'
+            else:
+                verified = None
+                self.misses += 1
+                event = 'token_cache.miss'
+        _emit(event)
+        return verified
+
+    def set(self, token, verified):
+        """Caches a `VerifiedToken` until the `exp` claim of its payload."""
+        exp = verified.payload.get('exp')
+        if self.maxsize <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = self.key(token)
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (verified, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        for _ in range(evicted):
+            _emit('token_cache.eviction')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        _emit('token_cache.clear')
+
+    def stats(self):
+        """Returns a dictionary of the cache counters."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries)
+        }
+
+
+jwks_store = JWKSKeyStore(AUTH0_JWKS_URL)
+token_cache = TokenCache()
+# Tokens verified with a key that has been rotated out must be verified again
+jwks_store.rotation_listeners.append(token_cache.clear)
+
+
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header.
     Code derived from https://auth0.com/docs/quickstart/backend/python.
@@ -46,23 +282,28 @@ def verify_decode_jwt(token):
     :returns: The decoded payload
     :raises AuthError: 401 if error decoding jwt or invalid signature
     """
-    jsonurl = urlopen('https://' + AUTH0_DOMAIN + '/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    return verify_token(token).payload
+
+
+def verify_token(token):
+    """Verify a JWT, using the cached result if the token has been verified before.
+
+    :param token: A json web token (string)
+    :returns: A `VerifiedToken` with the decoded payload and its permissions as a frozenset
+    :raises AuthError: 401 if error decoding jwt or invalid signature
+    """
+    verified = token_cache.get(token)
+    if verified is not None:
+        return verified
     try:
         unverified_header = jwt.get_unverified_header(token)
     except Exception:
         raise AuthError('error decoding token headers', 401)
-    rsa_key = {}
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    start = time.perf_counter()
+    rsa_key = jwks_store.get_key(unverified_header.get('kid'))
+    _emit_timing('auth.jwks', time.perf_counter() - start)
     if rsa_key:
+        start = time.perf_counter()
         try:
             payload = jwt.decode(
                 token,
@@ -71,14 +312,18 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
-            # Returns the payload if the JWT is valid.
-            return payload
         except jwt.ExpiredSignatureError:
             raise AuthError('token is expired', 401)
         except jwt.JWTClaimsError:
             raise AuthError('incorrect claims, please check the audience and issuer', 401)
         except Exception:
             raise AuthError('unable to parse authentication token', 401)
+        finally:
+            _emit_timing('auth.verify', time.perf_counter() - start)
+        # Returns the payload if the JWT is valid.
+        verified = VerifiedToken(payload, get_permissions(payload))
+        token_cache.set(token, verified)
+        return verified
     else:
         raise AuthError('unable to find appropriate key', 401)
 
@@ -92,26 +337,60 @@ def check_permissions(permission, payload):
     :raises AuthError: 401 if permissions are not included in the payload.
         403 if the requested permission string is not in the payload permissions array.
     """
-    # Return True if no permission (eg. None or empty string)
-    if permission:
-        if 'permissions' not in payload:
+    compile_permission_check(permission)(get_permissions(payload))
+    return True
+
+
+def compile_permission_check(permission=None, any_of=None):
+    """Builds a function checking the permissions of a token, so the required permissions are resolved once.
+
+    :param permission: String permission (i.e. 'view:movie') or an iterable of permissions that are all required
+    :param any_of: Optional iterable of permissions, at least one of which is required
+    :returns: A function taking the permissions of a token as a frozenset (or None if the token has no permissions
+        claim). It raises `AuthError` 401 if permissions are required but not included in the token, or 403 if a
+        required permission is not in the token permissions.
+    """
+    if isinstance(permission, str):
+        permission = [permission]
+    all_required = frozenset(p for p in permission or () if p)
+    any_required = frozenset(p for p in any_of or () if p)
+
+    def check(permissions):
+        # No permission required (eg. None or empty string)
+        if not all_required and not any_required:
+            return
+        if permissions is None:
             raise AuthError('permissions not in payload', 401)
-        if permission not in payload['permissions']:
+        if not all_required <= permissions:
             raise AuthError('permission not found', 403)
-    return True
+        if any_required and any_required.isdisjoint(permissions):
+            raise AuthError('permission not found', 403)
+    return check
 
 
-def requires_auth(permission=None):
+def has_permission(permission):
+    """Returns True if the token of the current request, verified by `requires_auth`, has the permission."""
+    permissions = getattr(_request_ctx_stack.top, 'current_permissions', None)
+    return permissions is not None and permission in permissions
+
+
+def requires_auth(permission=None, any_of=None):
     """Determines if the Access Token is valid.
     Code from https://auth0.com/docs/quickstart/backend/python.
+
+    :param permission: String permission (i.e. 'view:movie') or an iterable of permissions that are all required
+    :param any_of: Optional iterable of permissions, at least one of which is required
     """
+    check = compile_permission_check(permission, any_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            _request_ctx_stack.top.current_user = payload
-            check_permissions(permission, payload)
+            verified = verify_token(token)
+            _request_ctx_stack.top.current_user = verified.payload
+            _request_ctx_stack.top.current_permissions = verified.permissions
+            check(verified.permissions)
             return f(*args, **kwargs)
         return decorated
     return requires_auth_decorator
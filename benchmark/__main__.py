@@ -0,0 +1,132 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.client import HTTPConnection
+from benchmark.jwks import LocalJWKS
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Load test every route of the app.')
+    parser.add_argument('--size', type=int, default=1000, help='actors and movies seeded (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=50,
+                        help='requests sent to each route (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='requests sent at the same time (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=10,
+                        help='distinct tokens the requests are sent with (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the data and requests')
+    parser.add_argument('--database-url', default=None,
+                        help='database emptied and used by the run, defaults to a temporary SQLite database')
+    parser.add_argument('--gunicorn', action='store_true',
+                        help='send the requests over HTTP to local gunicorn workers instead of in-process')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (default: %(default)s)')
+    parser.add_argument('--output', help='file the results are saved to as JSON, e.g. to use as a baseline')
+    parser.add_argument('--baseline', help='JSON results of a previous run. Regressions fail the run')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase of the latencies, and decrease of the throughput, compared '
+                             'to the baseline (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port, workers, timeout=30):
+    """Starts gunicorn workers serving the app, with the environment of this process. Waits until they respond."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    executable = shutil.which('gunicorn', path=os.path.dirname(sys.executable)) or shutil.which('gunicorn')
+    if executable is None:
+        raise RuntimeError('gunicorn is not installed')
+    process = subprocess.Popen([executable, '--bind', f'127.0.0.1:{port}',
+                                '--workers', str(workers), 'app:create_app()'], cwd=root)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            connection = HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The app reads its settings when imported, so they are set first
+    domain = os.environ.setdefault('AUTH0_DOMAIN', 'benchmark.local')
+    audience = os.environ.setdefault('AUTH0_API_AUDIENCE', 'benchmark')
+    jwks = LocalJWKS(f'https://{domain}/', audience).start()
+    os.environ['AUTH0_JWKS_URL'] = jwks.url
+    temporary_directory = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{temporary_directory.name}/benchmark.db'
+
+    from app import create_app
+    from models import db
+    from benchmark.runner import (HTTPClient, Request, WSGIClient, compare, format_report, get_routes,
+                                  plan_requests, run_requests, summarize)
+    from benchmark.scenarios import seed
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    tokens = itertools.cycle([jwks.mint_token(f'benchmark|{i}') for i in range(args.users)])
+    server = None
+    try:
+        if args.gunicorn:
+            port = free_port()
+            server = start_gunicorn(port, args.workers)
+
+            def create_client():
+                return HTTPClient('127.0.0.1', port, next(tokens))
+        else:
+            def create_client():
+                return WSGIClient(app, next(tokens))
+
+        rng = random.Random(args.seed)
+        dataset = seed(create_client(), args.size, args.iterations, rng)
+        requests = plan_requests(get_routes(app), dataset, args.iterations, rng)
+        # Fetch the key set, verify the tokens and open the connections before the timed run
+        run_requests(create_client, [Request('warmup', 'GET', '/stats', None)] * args.concurrency * 4,
+                     args.concurrency)
+        results, seconds = run_requests(create_client, requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        jwks.stop()
+        temporary_directory.cleanup()
+    summary = summarize(results, seconds)
+    print(format_report(summary))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+    elif any(stats['errors'] for stats in summary['routes'].values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
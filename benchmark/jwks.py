@@ -0,0 +1,80 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import rsa
+from jose import jwt
+
+# Permissions of the executive producer role, which can use every endpoint
+ALL_PERMISSIONS = ['add:actor', 'add:movie', 'delete:actor', 'delete:movie', 'update:actor', 'update:movie',
+                   'view:actors', 'view:movies']
+
+
+def base64url_uint(value):
+    """Encodes an integer as unpadded base64url, the encoding of the RSA members of a JSON Web Key."""
+    return base64.urlsafe_b64encode(value.to_bytes((value.bit_length() + 7) // 8, 'big')).rstrip(b'=').decode()
+
+
+class LocalJWKS:
+    """Stand-in for the Auth0 JSON Web Key Set. Generates an RSA key pair, serves the public key at `url` and signs
+    tokens with the private key, so the app verifies tokens without Auth0.
+    """
+
+    def __init__(self, issuer, audience, kid='benchmark', key_size=2048):
+        self.issuer = issuer
+        self.audience = audience
+        self.kid = kid
+        public_key, private_key = rsa.newkeys(key_size)
+        self.private_key = private_key.save_pkcs1().decode()
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': base64url_uint(public_key.n),
+            'e': base64url_uint(public_key.e)
+        }]}
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def start(self):
+        """Serves the key set on a free local port in a background thread."""
+        body = json.dumps(self.jwks).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def mint_token(self, subject, permissions=ALL_PERMISSIONS, expires_in=3600):
+        """Returns a token signed like an Auth0 access token with the given permissions."""
+        now = int(time.time())
+        claims = {
+            'iss': self.issuer,
+            'sub': subject,
+            'aud': self.audience,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }
+        return jwt.encode(claims, self.private_key, algorithm='RS256', headers={'kid': self.kid})
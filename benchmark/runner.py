@@ -0,0 +1,165 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from benchmark.scenarios import SCENARIOS
+
+# A timed request: its route as "METHOD rule", status code, duration in seconds and number of SQL statements
+Result = namedtuple('Result', ['route', 'status', 'seconds', 'queries'])
+# A planned request
+Request = namedtuple('Request', ['route', 'method', 'path', 'body'])
+
+# Latencies within this many milliseconds of the baseline never count as regressions, to ignore timer noise
+LATENCY_SLACK_MS = 1.0
+# Mean queries per request that a route may exceed its baseline by, as response cache hits vary between runs
+QUERY_SLACK = 0.5
+
+
+class WSGIClient:
+    """Sends requests to the Flask application in-process."""
+
+    def __init__(self, app, token):
+        self.client = app.test_client()
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def request(self, method, path, body=None):
+        res = self.client.open(path, method=method, json=body, headers=self.headers)
+        return res.status_code, res.headers, res.get_json(silent=True)
+
+
+class HTTPClient:
+    """Sends requests to a server over a keep-alive HTTP connection."""
+
+    def __init__(self, host, port, token):
+        self.connection = HTTPConnection(host, port, timeout=60)
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def request(self, method, path, body=None):
+        headers = dict(self.headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, data, headers)
+        res = self.connection.getresponse()
+        raw = res.read()
+        is_json = res.headers.get('Content-Type', '').startswith('application/json')
+        return res.status, res.headers, json.loads(raw) if is_json and raw else None
+
+
+def get_routes(app):
+    """Returns the routes of an application as (method, URL rule) pairs."""
+    routes = set()
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        routes.update((method, rule.rule) for method in rule.methods - {'HEAD', 'OPTIONS'})
+    return routes
+
+
+def plan_requests(routes, dataset, iterations, rng):
+    """Returns the requests of a run: `iterations` requests to each route, in random order.
+
+    :raises ValueError: If a route has no scenario, so new routes can't be left out of the benchmark.
+    """
+    missing = routes - SCENARIOS.keys()
+    if missing:
+        raise ValueError('No benchmark scenario for the routes: ' + ', '.join(' '.join(r) for r in sorted(missing)))
+    requests = []
+    for method, rule in sorted(routes):
+        for _ in range(iterations):
+            path, body = SCENARIOS[(method, rule)](dataset, rng)
+            requests.append(Request(f'{method} {rule}', method, path, body))
+    rng.shuffle(requests)
+    return requests
+
+
+def run_requests(create_client, requests, concurrency):
+    """Sends the requests from `concurrency` threads, each with its own client.
+
+    :returns: The list of results, and the wall time of the run in seconds.
+    """
+    local = threading.local()
+
+    def send(planned):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = create_client()
+        start = time.perf_counter()
+        status, headers, _ = client.request(planned.method, planned.path, planned.body)
+        seconds = time.perf_counter() - start
+        return Result(planned.route, status, seconds, int(headers.get('X-DB-Queries', 0)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, requests))
+    return results, time.perf_counter() - start
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def summarize(results, seconds):
+    """Returns the request count, throughput, and latency percentiles (in milliseconds) and mean query count of each
+    route, as a dictionary that can be saved as a baseline.
+    """
+    by_route = defaultdict(list)
+    for result in results:
+        by_route[result.route].append(result)
+    routes = {}
+    for route, route_results in sorted(by_route.items()):
+        latencies = sorted(result.seconds * 1000 for result in route_results)
+        routes[route] = {
+            'requests': len(route_results),
+            'errors': sum(1 for result in route_results if not 200 <= result.status < 300),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries': round(sum(result.queries for result in route_results) / len(route_results), 2)
+        }
+    return {
+        'requests': len(results),
+        'seconds': round(seconds, 3),
+        'throughput': round(len(results) / seconds, 2) if seconds else 0.0,
+        'routes': routes
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """Compares a summary with a baseline summary.
+
+    :param tolerance: Allowed relative increase of the latency percentiles, and decrease of the throughput
+    :returns: A list of regression messages, empty if there are none. Failed requests and more queries per request
+        than the baseline are regressions.
+    """
+    regressions = []
+    for route, stats in summary['routes'].items():
+        if stats['errors']:
+            regressions.append(f'{route}: {stats["errors"]} failed requests')
+        base = baseline['routes'].get(route)
+        if base is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            limit = max(base[key] * (1 + tolerance), base[key] + LATENCY_SLACK_MS)
+            if stats[key] > limit:
+                regressions.append(f'{route}: {key} {stats[key]} > {base[key]} in the baseline')
+        if stats['queries'] > base['queries'] + QUERY_SLACK:
+            regressions.append(f'{route}: {stats["queries"]} queries per request > {base["queries"]} in the baseline')
+    if summary['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f'throughput {summary["throughput"]} < {baseline["throughput"]} requests/s in the baseline')
+    return regressions
+
+
+def format_report(summary):
+    lines = [f'{"route":<52} {"requests":>8} {"errors":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>7}']
+    for route, stats in summary['routes'].items():
+        lines.append(f'{route:<52} {stats["requests"]:>8} {stats["errors"]:>6} {stats["p50_ms"]:>9.2f} '
+                     f'{stats["p95_ms"]:>9.2f} {stats["p99_ms"]:>9.2f} {stats["queries"]:>7.2f}')
+    lines.append(f'{summary["requests"]} requests in {summary["seconds"]:.2f} s, '
+                 f'{summary["throughput"]:.1f} requests/s')
+    return '\n'.join(lines)
@@ -0,0 +1,231 @@
+import datetime as dt
+import itertools
+from collections import deque
+
+# Actors cast in each seeded movie
+CAST_SIZE = 5
+# Actors or movies per request when seeding
+SEED_BATCH_SIZE = 500
+# Actors or movies per request of the bulk endpoints
+BULK_SIZE = 10
+
+# Request builders by (method, URL rule), see `scenario`
+SCENARIOS = {}
+
+
+def scenario(method, rule):
+    """Registers a function `f(dataset, rng)` returning the path and JSON body (or None) of a request to a route."""
+    def decorator(f):
+        SCENARIOS[(method, rule)] = f
+        return f
+    return decorator
+
+
+def random_date(rng):
+    return (dt.date(1950, 1, 1) + dt.timedelta(days=rng.randrange(365 * 70))).isoformat()
+
+
+class Dataset:
+    """Ids of the seeded actors and movies. The routes deleting actors, movies or cast members consume ids reserved
+    for them, so they never delete the rows read by the other routes.
+    """
+
+    def __init__(self):
+        self.actor_ids = []
+        self.movie_ids = []
+        self.actor_names = {}
+        self.movies = {}
+        self.reserved = {}
+        self._names = itertools.count()
+
+    def reserve(self, name):
+        """Returns the next id, or cast pair, reserved for the route `name`."""
+        return self.reserved[name].popleft()
+
+    def new_name(self, prefix):
+        return f'{prefix} {next(self._names)}'
+
+
+def check(status, data):
+    if status != 200:
+        raise RuntimeError(f'Seeding failed with status {status}: {data}')
+    return data
+
+
+def create_all(client, path, items):
+    """Creates items with a bulk endpoint. Returns their ids in order."""
+    ids = []
+    for start in range(0, len(items), SEED_BATCH_SIZE):
+        status, _, data = client.request('POST', path, items[start:start + SEED_BATCH_SIZE])
+        ids.extend(created['id'] for created in check(status, data)['created'])
+    return ids
+
+
+def seed(client, size, iterations, rng):
+    """Seeds `size` actors and movies, each movie with `CAST_SIZE` actors, plus the rows reserved for the
+    `iterations` requests of each deleting route.
+
+    :returns: The `Dataset` of the seeded rows.
+    """
+    dataset = Dataset()
+    actors = [{'name': f'Actor {i}', 'age': rng.randrange(18, 90), 'gender': rng.choice(['female', 'male'])}
+              for i in range(size)]
+    dataset.actor_ids = create_all(client, '/actors/bulk', actors)
+    dataset.actor_names = {actor_id: actor['name'] for actor_id, actor in zip(dataset.actor_ids, actors)}
+    movies = [{'title': f'Movie {i}', 'release_date': random_date(rng)} for i in range(size)]
+    dataset.movie_ids = create_all(client, '/movies/bulk', movies)
+    dataset.movies = dict(zip(dataset.movie_ids, movies))
+    for movie_id in dataset.movie_ids:
+        status, _, data = client.request('POST', f'/movies/{movie_id}/actors',
+                                         {'actor_ids': rng.sample(dataset.actor_ids, min(CAST_SIZE, size))})
+        check(status, data)
+    for name in ('delete_actor', 'delete_actors'):
+        reserved = [{'name': f'{name} {i}', 'age': 30, 'gender': 'female'} for i in range(iterations)]
+        dataset.reserved[name] = deque(create_all(client, '/actors/bulk', reserved))
+    for name in ('delete_movie', 'delete_movies'):
+        reserved = [{'title': f'{name} {i}', 'release_date': '2000-01-01'} for i in range(iterations)]
+        dataset.reserved[name] = deque(create_all(client, '/movies/bulk', reserved))
+    cast_actors = [{'name': f'delete_movie_actor {i}', 'age': 30, 'gender': 'male'} for i in range(iterations)]
+    pairs = [(dataset.movie_ids[i % size], actor_id)
+             for i, actor_id in enumerate(create_all(client, '/actors/bulk', cast_actors))]
+    for movie_id, actor_id in pairs:
+        status, _, data = client.request('POST', f'/movies/{movie_id}/actors', {'actor_ids': [actor_id]})
+        check(status, data)
+    dataset.reserved['delete_movie_actor'] = deque(pairs)
+    return dataset
+
+
+@scenario('GET', '/')
+def get_index(dataset, rng):
+    return '/', None
+
+
+@scenario('GET', '/metrics')
+def get_metrics(dataset, rng):
+    return '/metrics', None
+
+
+@scenario('GET', '/actors')
+def get_actors(dataset, rng):
+    return f'/actors?limit=50&after_id={rng.choice(dataset.actor_ids)}', None
+
+
+@scenario('GET', '/movies')
+def get_movies(dataset, rng):
+    return f'/movies?limit=50&after_id={rng.choice(dataset.movie_ids)}&expand=cast', None
+
+
+@scenario('GET', '/actors/<int:actor_id>')
+def get_actor(dataset, rng):
+    return f'/actors/{rng.choice(dataset.actor_ids)}', None
+
+
+@scenario('GET', '/movies/<int:movie_id>')
+def get_movie(dataset, rng):
+    return f'/movies/{rng.choice(dataset.movie_ids)}', None
+
+
+@scenario('GET', '/movies/<int:movie_id>/actors')
+def get_movie_actors(dataset, rng):
+    return f'/movies/{rng.choice(dataset.movie_ids)}/actors', None
+
+
+@scenario('GET', '/actors/<int:actor_id>/movies')
+def get_actor_movies(dataset, rng):
+    return f'/actors/{rng.choice(dataset.actor_ids)}/movies', None
+
+
+@scenario('GET', '/stats')
+def get_stats(dataset, rng):
+    return '/stats', None
+
+
+@scenario('GET', '/search')
+def search(dataset, rng):
+    return f'/search?q={rng.choice(["Actor", "Movie"])}+{rng.randrange(10)}', None
+
+
+@scenario('POST', '/actors')
+def post_actor(dataset, rng):
+    return '/actors', {'name': dataset.new_name('New actor'), 'age': rng.randrange(18, 90), 'gender': 'female'}
+
+
+@scenario('POST', '/movies')
+def post_movie(dataset, rng):
+    return '/movies', {'title': dataset.new_name('New movie'), 'release_date': random_date(rng)}
+
+
+@scenario('POST', '/actors/bulk')
+def post_actors_bulk(dataset, rng):
+    return '/actors/bulk', [{'name': dataset.new_name('New actor'), 'age': rng.randrange(18, 90), 'gender': 'male'}
+                            for _ in range(BULK_SIZE)]
+
+
+@scenario('POST', '/movies/bulk')
+def post_movies_bulk(dataset, rng):
+    return '/movies/bulk', [{'title': dataset.new_name('New movie'), 'release_date': random_date(rng)}
+                            for _ in range(BULK_SIZE)]
+
+
+@scenario('PUT', '/actors')
+def put_actors(dataset, rng):
+    return '/actors', [{'name': dataset.actor_names[actor_id], 'age': rng.randrange(18, 90), 'gender': 'female'}
+                       for actor_id in rng.sample(dataset.actor_ids, min(BULK_SIZE, len(dataset.actor_ids)))]
+
+
+@scenario('PUT', '/movies')
+def put_movies(dataset, rng):
+    return '/movies', [dataset.movies[movie_id]
+                       for movie_id in rng.sample(dataset.movie_ids, min(BULK_SIZE, len(dataset.movie_ids)))]
+
+
+@scenario('POST', '/movies/<int:movie_id>/actors')
+def post_movie_actors(dataset, rng):
+    return f'/movies/{rng.choice(dataset.movie_ids)}/actors', {'actor_ids': rng.sample(dataset.actor_ids, 2)}
+
+
+@scenario('DELETE', '/movies/<int:movie_id>/actors/<int:actor_id>')
+def delete_movie_actor(dataset, rng):
+    return '/movies/{}/actors/{}'.format(*dataset.reserve('delete_movie_actor')), None
+
+
+@scenario('PATCH', '/actors/<int:actor_id>')
+def patch_actor(dataset, rng):
+    return f'/actors/{rng.choice(dataset.actor_ids)}', {'age': rng.randrange(18, 90)}
+
+
+@scenario('PATCH', '/movies/<int:movie_id>')
+def patch_movie(dataset, rng):
+    return f'/movies/{rng.choice(dataset.movie_ids)}', {'release_date': random_date(rng)}
+
+
+@scenario('PATCH', '/actors')
+def patch_actors(dataset, rng):
+    return '/actors', [{'id': actor_id, 'changes': {'age': rng.randrange(18, 90)}}
+                       for actor_id in rng.sample(dataset.actor_ids, min(BULK_SIZE, len(dataset.actor_ids)))]
+
+
+@scenario('PATCH', '/movies')
+def patch_movies(dataset, rng):
+    return '/movies', [{'id': movie_id, 'changes': {'release_date': random_date(rng)}}
+                       for movie_id in rng.sample(dataset.movie_ids, min(BULK_SIZE, len(dataset.movie_ids)))]
+
+
+@scenario('DELETE', '/actors')
+def delete_actors(dataset, rng):
+    return f'/actors?ids={dataset.reserve("delete_actors")}', None
+
+
+@scenario('DELETE', '/movies')
+def delete_movies(dataset, rng):
+    return f'/movies?ids={dataset.reserve("delete_movies")}', None
+
+
+@scenario('DELETE', '/actors/<int:actor_id>')
+def delete_actor(dataset, rng):
+    return f'/actors/{dataset.reserve("delete_actor")}', None
+
+
+@scenario('DELETE', '/movies/<int:movie_id>')
+def delete_movie(dataset, rng):
+    return f'/movies/{dataset.reserve("delete_movie")}', None
@@ -0,0 +1,213 @@
+import os
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+from flask import Response, request
+
+# Maximum number of responses kept by the in-process cache backend, 0 disables the response cache
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+# Maximum total bytes of the responses kept by the in-process cache backend
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Responses larger than this number of bytes are not cached, e.g. unpaginated lists of all actors
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 1024 * 1024))
+# Seconds a cached response is kept, 0 to keep responses until they are evicted or invalidated
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 0))
+# URL of a Redis compatible server to share the response cache between workers, e.g. redis://localhost:6379/0
+RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', None)
+
+
+class CacheBackend:
+    """Interface of a key-value store used by `ResponseCache`. Keys are strings and values are bytes."""
+
+    def get(self, key):
+        """Returns the value of the key, or None if the key is not set."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Sets the value of the key, expiring after `ttl` seconds if given."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Deletes all keys."""
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    """In-process least recently used cache. Each worker process has its own cache, bounded by the number of entries
+    and by the total bytes of their values.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _delete(self, key):
+        value, _ = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = (value, expires)
+            self.size_bytes += len(value)
+            # Least recently used first, including responses of superseded versions
+            while len(self._entries) > self.maxsize or self.size_bytes > self.max_bytes:
+                self._delete(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+class RedisCacheBackend(CacheBackend):
+    """Cache backend using a Redis compatible client (e.g. `redis.Redis`), shared between worker processes."""
+
+    def __init__(self, client, prefix='capstone:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def create_backend():
+    """Returns the cache backend configured by the environment: Redis if `RESPONSE_CACHE_REDIS_URL` is set,
+    otherwise the in-process LRU cache.
+    """
+    if RESPONSE_CACHE_REDIS_URL:
+        # Optional dependency, only needed to share the cache between workers
+        import redis
+        return RedisCacheBackend(redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL))
+    return LRUCacheBackend()
+
+
+def not_modified_response(etag):
+    """Returns an empty 304 not modified response with the ETag."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+class ResponseCache:
+    """Read-through cache of JSON responses of GET endpoints, invalidated by changes to the data.
+
+    Every resource (e.g. 'actors') has a version number, read by `version_getter`. Cache keys include the versions of
+    the resources of the endpoint, so bumping the version of a resource after a change invalidates every cached
+    response using it.
+    Cached responses also get a strong ETag derived from the key, and requests with a matching `If-None-Match`
+    header get a 304 response without running the endpoint.
+    """
+
+    def __init__(self, backend, version_getter, ttl=RESPONSE_CACHE_TTL, max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES):
+        """
+        :param backend: The `CacheBackend` storing the responses
+        :param version_getter: Function taking a tuple of resources and returning a dictionary of their versions,
+            e.g. change counters kept in the database
+        :param ttl: Seconds a response is cached, 0 to cache responses until they are evicted or invalidated
+        :param max_entry_bytes: Responses with larger bodies are not cached
+        """
+        self.backend = backend
+        self.version_getter = version_getter
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.enabled = not isinstance(backend, LRUCacheBackend) or backend.maxsize > 0
+        # Hit and miss counters by endpoint
+        self.counters = {}
+
+    def clear(self):
+        """Removes all cached responses and resets the statistics."""
+        self.backend.clear()
+        self.counters.clear()
+
+    def key(self, resources):
+        """Returns the cache key of the current request."""
+        versions = self.version_getter(resources)
+        versions = ','.join(f'{r}={versions.get(r, 0)}' for r in resources)
+        query = urlencode(sorted(request.args.items(multi=True)))
+        return f'response:{request.endpoint}:{versions}:{request.path}?{query}'
+
+    def _count(self, endpoint, counter):
+        counters = self.counters.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        counters[counter] += 1
+
+    def stats(self):
+        """Returns a dictionary of the hits, misses and hit rate by endpoint."""
+        stats = {}
+        for endpoint, counters in self.counters.items():
+            lookups = counters['hits'] + counters['misses']
+            stats[endpoint] = dict(counters, hit_rate=counters['hits'] / lookups if lookups else 0.0)
+        return stats
+
+    def cached(self, *resources, unless=None):
+        """Decorator caching the successful JSON responses of a GET endpoint by path and query string, and answering
+        conditional requests whose ETag matches the current versions of the resources with 304 not modified.
+
+        :param resources: Resources the response depends on
+        :param unless: Optional function, the response is not cached if it returns a true value
+        """
+        def cached_decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if unless is not None and unless():
+                    return f(*args, **kwargs)
+                key = self.key(resources)
+                etag = hashlib.sha1(key.encode()).hexdigest()
+                # Only a matching strong ETag skips the endpoint. `If-None-Match: *` matches any existing resource, so
+                # the endpoint runs first to find out if it exists, e.g. returns 404 not found
+                if request.if_none_match.is_strong(etag):
+                    return not_modified_response(etag)
+                body = self.backend.get(key) if self.enabled else None
+                if body is not None:
+                    self._count(request.endpoint, 'hits')
+                    if request.if_none_match.star_tag:
+                        return not_modified_response(etag)
+                    response = Response(body, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+                    response.set_etag(etag)
+                    return response
+                response = f(*args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200 and not response.is_streamed:
+                    if request.if_none_match.star_tag:
+                        return not_modified_response(etag)
+                    if self.enabled:
+                        self._count(request.endpoint, 'misses')
+                        body = response.get_data()
+                        if len(body) <= self.max_entry_bytes:
+                            self.backend.set(key, body, self.ttl)
+                        response.headers['X-Cache'] = 'MISS'
+                    response.set_etag(etag)
+                return response
+            return decorated
+        return cached_decorator
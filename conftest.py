@@ -0,0 +1,131 @@
+import os
+import pytest
+from flask import _app_ctx_stack
+from sqlalchemy import event, orm
+
+# The tests run offline: tokens are signed by a local key set, and the database defaults to in-memory SQLite
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('AUTH0_API_AUDIENCE', 'capstone')
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite://')
+
+import auth  # noqa: E402
+from app import create_app  # noqa: E402
+from benchmark.jwks import LocalJWKS  # noqa: E402
+from models import RoutingSession, db  # noqa: E402
+
+CASTING_ASSISTANT_PERMISSIONS = ['view:actors', 'view:movies']
+CASTING_DIRECTOR_PERMISSIONS = CASTING_ASSISTANT_PERMISSIONS + ['add:actor', 'delete:actor', 'update:actor',
+                                                                'update:movie']
+EXECUTIVE_PRODUCER_PERMISSIONS = CASTING_DIRECTOR_PERMISSIONS + ['add:movie', 'delete:movie']
+
+# Statements of the savepoints of the tests, not counted as statements of the requests
+SAVEPOINT_STATEMENTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+
+class SavepointSession(RoutingSession):
+    """Session bound to the connection of a test, whose transaction is rolled back after the test. The session works
+    in a SAVEPOINT that is restarted when the app commits or rolls back, so the transaction of the test survives.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closing = False
+        self.begin_nested()
+
+    def close(self):
+        self._closing = True
+        try:
+            # Closing a session does not release its SAVEPOINT, so it is rolled back first
+            if self.transaction is not None and self.transaction.nested:
+                self.rollback()
+            super().close()
+        finally:
+            self._closing = False
+        self.begin_nested()
+
+
+@event.listens_for(SavepointSession, 'after_transaction_end')
+def restart_savepoint(session, transaction):
+    if transaction.nested and not transaction._parent.nested and not session._closing:
+        session.expire_all()
+        session.begin_nested()
+
+
+def skip_savepoint_statements(conn, cursor, statement, parameters, context, executemany):
+    if statement.startswith(SAVEPOINT_STATEMENTS) and context is not None:
+        context.query_start_time = None
+
+
+def enable_sqlite_savepoints(engine):
+    """Lets SQLAlchemy emit BEGIN itself, as pysqlite's own transaction handling breaks SAVEPOINTs."""
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.execute('BEGIN')
+
+
+@pytest.fixture(scope='session')
+def jwks():
+    """Local stand-in for the Auth0 key set, used by the app to verify the tokens of the tests."""
+    local_jwks = LocalJWKS(f'https://{auth.AUTH0_DOMAIN}/', auth.API_AUDIENCE, key_size=1024).start()
+    original_store = auth.jwks_store
+    auth.jwks_store = auth.JWKSKeyStore(local_jwks.url)
+    auth.jwks_store.rotation_listeners.append(auth.token_cache.clear)
+    yield local_jwks
+    auth.jwks_store = original_store
+    local_jwks.stop()
+
+
+@pytest.fixture(scope='session')
+def app(jwks):
+    """App of the test database, whose schema is created once for the session."""
+    app = create_app(test_config=True)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            enable_sqlite_savepoints(db.engine)
+        event.listen(db.engine, 'before_cursor_execute', skip_savepoint_statements)
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    """Test client whose database changes are rolled back at the end of the test."""
+    app.response_cache.clear()
+    auth.token_cache.clear()
+    # Tests creating their own app replace the app used by `db` outside of requests
+    db.app = app
+    with app.app_context():
+        connection = db.engine.connect()
+    transaction = connection.begin()
+    original_session = db.session
+    db.session = orm.scoped_session(orm.sessionmaker(class_=SavepointSession, db=db, bind=connection, binds={}),
+                                    scopefunc=_app_ctx_stack.__ident_func__)
+    try:
+        yield app.test_client()
+    finally:
+        db.session.remove()
+        db.session = original_session
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope='session')
+def casting_assistant_jwt(jwks):
+    return jwks.mint_token('auth0|casting-assistant', CASTING_ASSISTANT_PERMISSIONS)
+
+
+@pytest.fixture(scope='session')
+def casting_director_jwt(jwks):
+    return jwks.mint_token('auth0|casting-director', CASTING_DIRECTOR_PERMISSIONS)
+
+
+@pytest.fixture(scope='session')
+def executive_producer_jwt(jwks):
+    return jwks.mint_token('auth0|executive-producer', EXECUTIVE_PRODUCER_PERMISSIONS)
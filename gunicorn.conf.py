@@ -0,0 +1,12 @@
+# Gunicorn settings, loaded automatically by `gunicorn "app:create_app()"`
+import os
+from prometheus_client import multiprocess
+
+# Directory shared by the workers to aggregate their metrics, see `metrics.PROMETHEUS_MULTIPROC_DIR`
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', os.environ.get('prometheus_multiproc_dir'))
+
+
+def child_exit(server, worker):
+    """Removes the live metrics (e.g. gauges) of a stopped worker in Prometheus multiprocess mode."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid, PROMETHEUS_MULTIPROC_DIR)
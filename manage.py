@@ -2,7 +2,8 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import create_app
-from models import db
+from models import db, rebuild_stats as rebuild_stat_counters
+from profiling import PROFILE_DIR, aggregate_profiles
 
 app = create_app()
 
@@ -12,5 +13,20 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def rebuild_stats():
+    """Recompute the summary counters of GET /stats from the actors and movies tables."""
+    rebuild_stat_counters()
+
+
+@manager.command
+def profile_report(directory=PROFILE_DIR, limit=20):
+    """Merge the request profiles by route, write the collapsed stacks of each route and print the slowest calls."""
+    if not directory:
+        print('Set PROFILE_DIR or pass --directory')
+        return
+    print(aggregate_profiles(directory, int(limit)))
+
+
 if __name__ == '__main__':
     manager.run()
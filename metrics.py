@@ -0,0 +1,154 @@
+import os
+import hmac
+import time
+from flask import Response, abort, g, has_request_context, request
+from flask.json import JSONEncoder
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import auth
+from models import get_pool_stats
+
+# Directory shared by the gunicorn workers to aggregate their metrics. Must be emptied before the server starts.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', os.environ.get('prometheus_multiproc_dir'))
+# Optional token required to read the metrics, sent as `Authorization: Bearer <token>`
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', None)
+
+REQUESTS = Counter('http_requests_total', 'Requests by route and status', ['method', 'route', 'status'])
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time to build the response, by route',
+                             ['method', 'route'])
+DB_DURATION = Histogram('http_request_db_duration_seconds', 'Time spent in the database per request, by route',
+                        ['route'])
+SERIALIZATION_DURATION = Histogram('http_request_serialization_duration_seconds',
+                                   'Time spent encoding JSON per request, by route', ['route'])
+AUTH_DURATION = Histogram('auth_duration_seconds', 'Time spent verifying tokens, by step: jwks (key lookup and '
+                          'fetch) or verify (signature and claims)', ['step'],
+                          buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+AUTH_CACHE_EVENTS = Counter('auth_cache_events_total', 'Token cache events, e.g. hit or miss', ['event'])
+RESPONSE_CACHE_RESULTS = Counter('response_cache_results_total', 'Response cache lookups by route and result',
+                                 ['route', 'result'])
+
+
+def observe_auth_timing(name, seconds):
+    AUTH_DURATION.labels(name.split('.', 1)[1]).observe(seconds)
+
+
+def count_auth_event(event):
+    AUTH_CACHE_EVENTS.labels(event.split('.', 1)[1]).inc()
+
+
+auth.timing_hooks.append(observe_auth_timing)
+auth.instrumentation_hooks.append(count_auth_event)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """JSON encoder adding the time spent encoding to the serialization time of the current request."""
+
+    def encode(self, o):
+        start = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            if has_request_context():
+                g.serialization_time = g.get('serialization_time', 0.0) + time.perf_counter() - start
+
+
+def timed(encoder_class):
+    """Returns a subclass of a JSON encoder class adding its encoding time to the serialization time, see
+    `TimedJSONEncoder`.
+    """
+    return type('Timed' + encoder_class.__name__, (TimedJSONEncoder, encoder_class), {})
+
+
+class PoolCollector:
+    """Collects the connection pool statistics of the primary database and read replicas of the app of this worker,
+    see `get_pool_stats`, labeled by database.
+    """
+
+    def __init__(self):
+        self.app = None
+
+    def collect(self):
+        stats = get_pool_stats(self.app) if self.app is not None else {}
+        connections = GaugeMetricFamily('db_pool_connections', 'Connections of the pool by state: checked_in, '
+                                        'checked_out or overflow', labels=['database', 'state'])
+        families = [
+            (GaugeMetricFamily('db_pool_size', 'Connections kept open by the pool', labels=['database']), 'size'),
+            (CounterMetricFamily('db_pool_checkouts', 'Connections checked out of the pool', labels=['database']),
+             'checkouts'),
+            (CounterMetricFamily('db_pool_timeouts', 'Checkouts that timed out waiting for a connection',
+                                 labels=['database']), 'timeouts'),
+            (CounterMetricFamily('db_pool_wait_seconds', 'Time spent waiting for a connection',
+                                 labels=['database']), 'wait_time'),
+            (GaugeMetricFamily('db_pool_max_wait_seconds', 'Longest wait for a connection', labels=['database']),
+             'max_wait_time'),
+            (GaugeMetricFamily('db_pool_max_overflow_used', 'Most overflow connections open at once',
+                               labels=['database']), 'max_overflow_used')
+        ]
+        for database, pool_stats in stats.items():
+            for state in ('checked_in', 'checked_out', 'overflow'):
+                connections.add_metric([database, state], pool_stats[state])
+            for family, key in families:
+                family.add_metric([database], pool_stats[key])
+        yield connections
+        for family, _ in families:
+            yield family
+
+
+# Registered once, as a registry can not have two collectors of the same metrics
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+def get_route():
+    """Returns the URL rule of the current request, e.g. '/actors/<int:actor_id>', so labels have few values."""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def start_timer():
+    g.request_start_time = time.perf_counter()
+
+
+def record_request(response):
+    """Records the count and durations of the current request."""
+    start = g.get('request_start_time', None)
+    if start is None:
+        return response
+    route = get_route()
+    REQUESTS.labels(request.method, route, response.status_code).inc()
+    REQUEST_DURATION.labels(request.method, route).observe(time.perf_counter() - start)
+    DB_DURATION.labels(route).observe(g.get('db_time', 0.0))
+    SERIALIZATION_DURATION.labels(route).observe(g.get('serialization_time', 0.0))
+    cache_result = response.headers.get('X-Cache', None)
+    if response.status_code == 304:
+        cache_result = 'NOT_MODIFIED'
+    if cache_result is not None:
+        RESPONSE_CACHE_RESULTS.labels(route, cache_result.lower()).inc()
+    return response
+
+
+def metrics_response():
+    """Builds the response of the metrics endpoint in the Prometheus text format. In multiprocess mode the metrics
+    of all worker processes are aggregated.
+
+    :raises HTTPException: 401 unauthorized if `METRICS_TOKEN` is set and the request does not send it.
+    """
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        abort(401)
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Pools are not shared, so only the pools of the worker serving the request are reported
+        registry.register(pool_collector)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """Records the metrics of the requests of an application and serves them at GET "/metrics"."""
+    app.json_encoder = timed(app.json_encoder)
+    pool_collector.app = app
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_response)
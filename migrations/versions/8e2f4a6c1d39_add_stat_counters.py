@@ -0,0 +1,173 @@
+"""add stat counters
+
+Revision ID: 8e2f4a6c1d39
+Revises: 5d0b7c3e9a16
+Create Date: 2026-10-16 17:05:13.284671
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2f4a6c1d39'
+down_revision = '5d0b7c3e9a16'
+branch_labels = None
+depends_on = None
+
+# Trigger functions adding the inserted rows to, and subtracting the deleted rows from, the summary counters. They
+# run once per statement with the changed rows in the transition tables new_rows and old_rows (PostgreSQL 10+).
+UPDATE_ACTORS_STATS = """
+    CREATE OR REPLACE FUNCTION update_actors_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'actors' AS metric, '' AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'actors_gender' AS metric, gender AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'actors_age' AS metric, CAST((age / 10) * 10 AS TEXT) AS bucket,
+                    1 AS delta FROM new_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'actors' AS metric, '' AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'actors' AS metric, '' AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'actors_gender' AS metric, gender AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'actors_gender' AS metric, gender AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'actors_age' AS metric, CAST((age / 10) * 10 AS TEXT) AS bucket,
+                    1 AS delta FROM new_rows
+                UNION ALL SELECT 'actors_age' AS metric, CAST((age / 10) * 10 AS TEXT) AS bucket,
+                    -1 AS delta FROM old_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        ELSE
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'actors' AS metric, '' AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'actors_gender' AS metric, gender AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'actors_age' AS metric, CAST((age / 10) * 10 AS TEXT) AS bucket,
+                    -1 AS delta FROM old_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+UPDATE_MOVIES_STATS = """
+    CREATE OR REPLACE FUNCTION update_movies_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'movies' AS metric, '' AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'movies_year' AS metric, to_char(release_date, 'YYYY') AS bucket,
+                    1 AS delta FROM new_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'movies' AS metric, '' AS bucket, 1 AS delta FROM new_rows
+                UNION ALL SELECT 'movies' AS metric, '' AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'movies_year' AS metric, to_char(release_date, 'YYYY') AS bucket,
+                    1 AS delta FROM new_rows
+                UNION ALL SELECT 'movies_year' AS metric, to_char(release_date, 'YYYY') AS bucket,
+                    -1 AS delta FROM old_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        ELSE
+            INSERT INTO stat_counters (metric, bucket, count)
+            SELECT metric, bucket, SUM(delta) FROM (
+                SELECT 'movies' AS metric, '' AS bucket, -1 AS delta FROM old_rows
+                UNION ALL SELECT 'movies_year' AS metric, to_char(release_date, 'YYYY') AS bucket,
+                    -1 AS delta FROM old_rows
+            ) AS deltas
+            WHERE bucket IS NOT NULL GROUP BY metric, bucket
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+TRIGGERS = [
+    'CREATE TRIGGER actors_stats_insert AFTER INSERT ON actors REFERENCING NEW TABLE AS new_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_actors_stats()',
+    'CREATE TRIGGER actors_stats_update AFTER UPDATE ON actors REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_actors_stats()',
+    'CREATE TRIGGER actors_stats_delete AFTER DELETE ON actors REFERENCING OLD TABLE AS old_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_actors_stats()',
+    'CREATE TRIGGER movies_stats_insert AFTER INSERT ON movies REFERENCING NEW TABLE AS new_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_movies_stats()',
+    'CREATE TRIGGER movies_stats_update AFTER UPDATE ON movies REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_movies_stats()',
+    'CREATE TRIGGER movies_stats_delete AFTER DELETE ON movies REFERENCING OLD TABLE AS old_rows '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE update_movies_stats()',
+]
+
+# Counts the existing rows
+REBUILD_STATS = [
+    """
+    INSERT INTO stat_counters (metric, bucket, count)
+    SELECT metric, bucket, SUM(delta) FROM (
+        SELECT 'actors' AS metric, '' AS bucket, 1 AS delta FROM actors
+        UNION ALL SELECT 'actors_gender' AS metric, gender AS bucket, 1 AS delta FROM actors
+        UNION ALL SELECT 'actors_age' AS metric, CAST((age / 10) * 10 AS TEXT) AS bucket, 1 AS delta FROM actors
+    ) AS deltas
+    WHERE bucket IS NOT NULL GROUP BY metric, bucket
+    ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count
+    """,
+    """
+    INSERT INTO stat_counters (metric, bucket, count)
+    SELECT metric, bucket, SUM(delta) FROM (
+        SELECT 'movies' AS metric, '' AS bucket, 1 AS delta FROM movies
+        UNION ALL SELECT 'movies_year' AS metric, to_char(release_date, 'YYYY') AS bucket, 1 AS delta FROM movies
+    ) AS deltas
+    WHERE bucket IS NOT NULL GROUP BY metric, bucket
+    ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count
+    """,
+]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('stat_counters',
+    sa.Column('metric', sa.String(length=50), nullable=False),
+    sa.Column('bucket', sa.String(length=200), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'bucket')
+    )
+    # ### end Alembic commands ###
+    # Version of the counters, bumped when they are rebuilt
+    table_versions = sa.table('table_versions', sa.column('name', sa.String), sa.column('version', sa.BigInteger))
+    op.bulk_insert(table_versions, [{'name': 'stat_counters', 'version': 0}])
+    # The triggers maintaining the counters are PostgreSQL only
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(UPDATE_ACTORS_STATS)
+    op.execute(UPDATE_MOVIES_STATS)
+    for statement in TRIGGERS:
+        op.execute(statement)
+    for statement in REBUILD_STATS:
+        op.execute(statement)
+
+
+def downgrade():
+    op.execute("DELETE FROM table_versions WHERE name = 'stat_counters'")
+    if op.get_bind().dialect.name == 'postgresql':
+        for table_name in ('actors', 'movies'):
+            for operation in ('insert', 'update', 'delete'):
+                op.execute(f'DROP TRIGGER IF EXISTS {table_name}_stats_{operation} ON {table_name}')
+            op.execute(f'DROP FUNCTION IF EXISTS update_{table_name}_stats()')
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('stat_counters')
+    # ### end Alembic commands ###
@@ -0,0 +1,30 @@
+"""add search trigram indexes
+
+Revision ID: 9b1d6e3f2a84
+Revises: 4f2c9a1e7b3d
+Create Date: 2026-10-16 10:03:17.932614
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1d6e3f2a84'
+down_revision = '4f2c9a1e7b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The GIN options are PostgreSQL only, other databases create plain indexes like `create_all`
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
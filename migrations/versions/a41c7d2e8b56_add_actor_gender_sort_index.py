@@ -0,0 +1,25 @@
+"""add actor gender sort index
+
+Revision ID: a41c7d2e8b56
+Revises: 8e2f4a6c1d39
+Create Date: 2026-10-17 10:21:37.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7d2e8b56'
+down_revision = '8e2f4a6c1d39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sort order of GET /actors?sort=gender, which sorts NULL genders as empty strings
+    op.create_index('ix_actors_gender_sort', 'actors', [sa.text("coalesce(gender, '')"), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actors_gender_sort', table_name='actors')
@@ -1,31 +1,711 @@
 import os
-import datetime as dt
-from flask_sqlalchemy import SQLAlchemy
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import case, create_engine, event, exc, func, literal, orm, select, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import SelectBase
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 
+# Maximum number of rows in one multi-row INSERT, UPDATE or DELETE statement
+INSERT_BATCH_SIZE = 1000
 
-db = SQLAlchemy()
+# Statements slower than this many milliseconds are logged, with their parameters redacted. 0 to disable
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+# Maximum number of characters of a logged statement
+SLOW_QUERY_LOG_LENGTH = 1000
 
+logger = logging.getLogger(__name__)
 
-def setup_db(app, database_path=None):
-    """Binds a flask application and a SQLAlchemy service."""
+# Comma separated URLs of read replicas of DATABASE_URL. GET requests read from a replica until they write.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# How a replica is chosen for a request: 'round_robin', or 'least_loaded' for the fewest connections in use
+DATABASE_REPLICA_STRATEGY = os.environ.get('DATABASE_REPLICA_STRATEGY', 'round_robin')
+# Seconds between health checks of each replica. A failed replica is out of rotation until its next check.
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.environ.get('REPLICA_HEALTH_CHECK_INTERVAL', 10))
+
+# Connection pool of each worker process. A worker opens at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+# Connections kept open in the pool
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+# Extra connections opened when the pool is exhausted, closed when they are returned
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a connection when the pool and overflow are exhausted before failing
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced, -1 to keep connections open indefinitely
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Test connections with a lightweight ping when they are checked out, replacing connections closed by the server
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true')
+# Connect through PgBouncer (or another external pool): open a connection per checkout instead of keeping a pool
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '').lower() in ('1', 'true')
+
+# Connection pool settings that can be given to `setup_db`, with their defaults from the environment
+POOL_SETTINGS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    'pgbouncer': DB_PGBOUNCER
+}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """Queue pool counting connection checkouts, the time waited for a connection, timeouts and overflow."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_overflow_used = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            self.max_overflow_used = max(self.max_overflow_used, self.overflow())
+        return connection
+
+    def stats(self):
+        """Returns a dictionary of the pool counters and current state."""
+        return {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow_used': self.max_overflow_used,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time
+        }
+
+
+class ReplicaRouter:
+    """Chooses the read replica of a request among the healthy replicas.
+
+    Replicas are health checked with `SELECT 1` every `health_check_interval` seconds by a background thread started
+    by `start`, so requests never wait for a check. A replica is taken out of rotation if a check fails or a query on
+    it loses the connection, until it passes a check again.
+    """
+
+    def __init__(self, engines, strategy=DATABASE_REPLICA_STRATEGY,
+                 health_check_interval=REPLICA_HEALTH_CHECK_INTERVAL):
+        """
+        :param engines: Engines of the replicas
+        :param strategy: 'round_robin' or 'least_loaded'
+        """
+        if strategy not in ('round_robin', 'least_loaded'):
+            raise ValueError(f'unknown replica strategy: {strategy}')
+        self.engines = list(engines)
+        self.strategy = strategy
+        self.health_check_interval = health_check_interval
+        self._healthy = [True] * len(self.engines)
+        # Connections of each replica checked out of its pool. Counted with events, as not every pool (e.g. NullPool)
+        # counts its connections
+        self._checked_out = [0] * len(self.engines)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        for index, engine in enumerate(self.engines):
+            event.listen(engine, 'handle_error', self._error_handler(index))
+            event.listen(engine, 'checkout', self._checkout_counter(index, 1))
+            event.listen(engine, 'checkin', self._checkout_counter(index, -1))
+
+    def _error_handler(self, index):
+        def handle_error(context):
+            # Connection refused or lost, e.g. the replica is down
+            if context.is_disconnect or context.connection is None:
+                self.mark_unhealthy(index)
+        return handle_error
+
+    def _checkout_counter(self, index, change):
+        def count(*args):
+            with self._lock:
+                self._checked_out[index] += change
+        return count
+
+    def mark_unhealthy(self, index):
+        with self._lock:
+            self._healthy[index] = False
+
+    def check(self, index):
+        """Checks if a replica accepts queries. Returns True if it is healthy."""
+        try:
+            with self.engines[index].connect() as connection:
+                connection.execute(select([literal(1)]))
+            return True
+        except Exception as e:
+            logger.warning('health check of replica %r failed: %s', self.engines[index].url, e)
+            return False
+
+    def check_all(self):
+        """Checks every replica and updates their health."""
+        for index in range(len(self.engines)):
+            healthy = self.check(index)
+            with self._lock:
+                self._healthy[index] = healthy
+
+    def start(self):
+        """Checks every replica, then starts the background thread checking them every `health_check_interval`
+        seconds until `stop` is called.
+        """
+        self.check_all()
+
+        def run():
+            while not self._stopped.wait(self.health_check_interval):
+                self.check_all()
+
+        threading.Thread(target=run, name='replica-health-check', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_healthy(self, index):
+        """Returns True if a replica passed its last health check and has not lost its connection since."""
+        return self._healthy[index]
+
+    def choose(self):
+        """Returns the engine of a healthy replica, or None if no replica is healthy."""
+        candidates = [index for index in range(len(self.engines)) if self.is_healthy(index)]
+        if not candidates:
+            return None
+        if self.strategy == 'least_loaded':
+            index = min(candidates, key=lambda i: self._checked_out[i])
+        else:
+            index = candidates[next(self._counter) % len(candidates)]
+        return self.engines[index]
+
+    def stats(self):
+        """Returns a list of the URL (without password) and health of each replica."""
+        return [{'url': repr(engine.url), 'healthy': healthy} for engine, healthy in zip(self.engines, self._healthy)]
+
+
+class RoutingSession(SignallingSession):
+    """Session reading from a read replica in GET and HEAD requests, and from the primary database otherwise.
+
+    Once the session writes, or executes a statement that is not a SELECT, every following query of the session goes
+    to the primary so the request reads its own writes. A session uses one replica, so its reads are consistent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._replica = None
+        self._primary_only = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or (clause is not None and not isinstance(clause, SelectBase)):
+            self._primary_only = True
+        if not self._primary_only and has_request_context() and request.method in ('GET', 'HEAD'):
+            router = getattr(self.app, 'replica_router', None)
+            if router is not None:
+                if self._replica is None:
+                    self._replica = router.choose()
+                if self._replica is not None:
+                    return self._replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions route reads to replicas, see `RoutingSession`."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def get_engine_options(database_path, pool_settings=None):
+    """Returns the SQLAlchemy engine options of the connection pool.
+
+    :param database_path: Database URL. SQLite databases keep the default pool of the SQLite dialect.
+    :param pool_settings: Optional dictionary overriding the `POOL_SETTINGS` from the environment. Other keys are
+        ignored.
+    """
+    if database_path.startswith('sqlite'):
+        return {}
+    settings = dict(POOL_SETTINGS)
+    settings.update((key, value) for key, value in (pool_settings or {}).items() if key in POOL_SETTINGS)
+    if settings.pop('pgbouncer'):
+        # PgBouncer pools the server connections, a second pool in each worker would hold them idle
+        return {'poolclass': NullPool}
+    return dict(settings, poolclass=InstrumentedQueuePool)
+
+
+def redact_parameters(parameters):
+    """Returns the parameters of a statement with each value replaced by its type name, so logs do not contain data.
+    The parameters of an executemany are summarized by their number of rows and the types of the first row.
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return {'rows': len(parameters), 'first': redact_parameters(parameters[0])}
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start_time = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Adds a statement to the query count and database time of the current request, and logs it if it is slow."""
+    start = getattr(context, 'query_start_time', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning('slow query (%.1f ms) on %s: %s parameters: %s', elapsed * 1000,
+                       request.endpoint if has_request_context() else None,
+                       ' '.join(statement.split())[:SLOW_QUERY_LOG_LENGTH], redact_parameters(parameters))
+
+
+def add_query_headers(response):
+    """Adds the number of statements and the database time of the request to the response headers `X-DB-Queries`
+    and `Server-Timing`. Statements run while streaming the body are not included.
+    """
+    queries = g.get('db_queries', 0)
+    db_time = g.get('db_time', 0.0)
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers.add('Server-Timing', f'db;dur={db_time * 1000:.1f};desc="{queries} queries"')
+    return response
+
+
+def setup_db(app, database_path=None, pool_settings=None, replica_urls=None):
+    """Binds a flask application and a SQLAlchemy service.
+
+    :param pool_settings: Optional dictionary of connection pool settings overriding the environment, with keys of
+        `POOL_SETTINGS`
+    :param replica_urls: URLs of read replicas, defaults to the environment variable DATABASE_REPLICA_URLS
+    """
     # Set the default database path to the environment variable DATABASE_URL
     if database_path is None:
         database_path = os.environ['DATABASE_URL']
+    if replica_urls is None:
+        replica_urls = DATABASE_REPLICA_URLS
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(database_path, pool_settings)
+    app.replica_router = None
+    if replica_urls:
+        app.replica_router = ReplicaRouter(
+            [create_engine(url, **get_engine_options(url, pool_settings)) for url in replica_urls]
+        ).start()
+    # Count and time the statements of every engine, including replicas
+    for name, listener in (('before_cursor_execute', before_cursor_execute),
+                           ('after_cursor_execute', after_cursor_execute)):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    app.after_request(add_query_headers)
     db.app = app
     app.db = db
     db.init_app(app)
 
 
+def get_pool_stats(app):
+    """Returns the connection pool statistics of this worker, as a dictionary of `InstrumentedQueuePool.stats()` by
+    database: 'primary', then 'replica_0', 'replica_1', ... Pools that are not instrumented (e.g. SQLite or PgBouncer
+    mode) are left out.
+    """
+    engines = [('primary', db.get_engine(app))]
+    router = getattr(app, 'replica_router', None)
+    if router is not None:
+        engines.extend((f'replica_{index}', engine) for index, engine in enumerate(router.engines))
+    return {name: engine.pool.stats() for name, engine in engines if isinstance(engine.pool, InstrumentedQueuePool)}
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Enforces foreign keys in SQLite databases (e.g. for tests), which are not enforced by default."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def format_columns(columns, row):
+    """Returns a dictionary with key:value pairs of a result row of the given column names. Dates are kept as dates,
+    encoded as "yyyy-mm-dd" by the JSON encoder of the app.
+    """
+    return dict(zip(columns, row))
+
+
+class TableVersion(db.Model):
+    """SQLAlchemy model for the change counter of a table.
+    The counter is incremented in the same transaction as every change to the table, so it can be used as a cheap
+    version stamp of the whole table (e.g. for ETags).
+    """
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(length=100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<TableVersion name:{self.name} version:{self.version}>'
+
+
+# Tables with a change counter. The summary counters of 'stat_counters' follow the changes of their counted tables,
+# their own counter is only incremented when they are rebuilt
+VERSIONED_TABLES = ('actors', 'movies', 'movie_actors', 'stat_counters')
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def insert_table_versions(target, connection, **kwargs):
+    """Creates the change counters of the versioned tables when the table is created by `create_all`."""
+    connection.execute(target.insert(), [{'name': name, 'version': 0} for name in VERSIONED_TABLES])
+
+
+def bump_table_version(name):
+    """Increments the change counter of a table in the current transaction."""
+    table = TableVersion.__table__
+    db.session.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1))
+
+
+def get_table_versions(names):
+    """Returns a dictionary of the change counters of the tables by name, using one query."""
+    rows = db.session.query(TableVersion.name, TableVersion.version).filter(TableVersion.name.in_(names)).all()
+    return dict(rows)
+
+
+def returning_supported():
+    """Returns True if the database supports INSERT/UPDATE/DELETE ... RETURNING."""
+    return db.engine.dialect.name == 'postgresql'
+
+
+def insert_rows(model, rows):
+    """Inserts rows of a model in one transaction and commits it.
+
+    In PostgreSQL the rows are inserted in batches of `INSERT_BATCH_SIZE` with multi-row
+    `INSERT ... VALUES (...), (...) RETURNING id` statements. Other databases use `bulk_insert_mappings`.
+
+    :param model: Model class of the rows
+    :param rows: List of dictionaries of column values
+    :returns: The ids of the inserted rows, in the same order as the rows
+    """
+    table = model.__table__
+    ids = []
+    if rows:
+        if returning_supported():
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                statement = table.insert().values(rows[start:start + INSERT_BATCH_SIZE]).returning(table.c.id)
+                ids.extend(row[0] for row in db.session.execute(statement))
+        else:
+            mappings = [dict(row) for row in rows]
+            db.session.bulk_insert_mappings(model, mappings, return_defaults=True)
+            ids = [mapping['id'] for mapping in mappings]
+        bump_table_version(table.name)
+    db.session.commit()
+    return ids
+
+
+def update_row(model, object_id, values):
+    """Updates a row of a model by id and commits it, without loading the row first.
+
+    In PostgreSQL the row is updated and returned by one `UPDATE ... SET ... WHERE id = :id RETURNING *` statement.
+    Other databases select the row after updating it.
+
+    :param model: Model class of the row
+    :param values: Dictionary of changed column values
+    :returns: The updated row, or None if there is no row with the id
+    """
+    table = model.__table__
+    statement = table.update().where(table.c.id == object_id).values(values)
+    if returning_supported():
+        row = db.session.execute(statement.returning(*table.c)).first()
+    else:
+        result = db.session.execute(statement)
+        row = None
+        if result.rowcount:
+            row = db.session.execute(select(table.c).where(table.c.id == object_id)).first()
+    if row is not None:
+        bump_table_version(table.name)
+    db.session.commit()
+    return row
+
+
+def delete_row(model, object_id):
+    """Deletes a row of a model by id and commits it, without loading the row first.
+
+    In PostgreSQL the row is deleted by one `DELETE ... WHERE id = :id RETURNING id` statement.
+
+    :param model: Model class of the row
+    :returns: The id of the deleted row, or None if there is no row with the id
+    """
+    table = model.__table__
+    statement = table.delete().where(table.c.id == object_id)
+    if returning_supported():
+        deleted_id = db.session.execute(statement.returning(table.c.id)).scalar()
+    else:
+        deleted_id = object_id if db.session.execute(statement).rowcount else None
+    if deleted_id is not None:
+        bump_table_version(table.name)
+    db.session.commit()
+    return deleted_id
+
+
+def case_update_statement(table, ids, changes):
+    """Returns one `UPDATE ... SET column = CASE id WHEN :id THEN :value ... ELSE column END WHERE id IN (...)`
+    statement applying the changes of the rows with the ids.
+
+    :param changes: Dictionary of dictionaries of changed column values by id
+    """
+    columns = {column for object_id in ids for column in changes[object_id]}
+    values = {}
+    for column in columns:
+        whens = {object_id: changes[object_id][column] for object_id in ids if column in changes[object_id]}
+        values[column] = case(whens, value=table.c.id, else_=table.c[column])
+    return table.update().where(table.c.id.in_(ids)).values(values)
+
+
+def update_rows(model, changes):
+    """Updates rows of a model by id in one transaction and commits it.
+
+    Each batch of `INSERT_BATCH_SIZE` rows is updated with one set based statement,
+    `UPDATE ... SET column = CASE id WHEN :id THEN :value ... ELSE column END WHERE id IN (...)`.
+    In PostgreSQL the updated ids are returned by the statement, other databases select them first.
+
+    :param model: Model class of the rows
+    :param changes: Dictionary of dictionaries of changed column values by id
+    :returns: The ids of the updated rows. Ids in `changes` without a row are not included.
+    """
+    table = model.__table__
+    updated = []
+    ids = list(changes)
+    for start in range(0, len(ids), INSERT_BATCH_SIZE):
+        batch = ids[start:start + INSERT_BATCH_SIZE]
+        statement = case_update_statement(table, batch, changes)
+        if returning_supported():
+            updated.extend(row[0] for row in db.session.execute(statement.returning(table.c.id)))
+        else:
+            updated.extend(row[0] for row in db.session.execute(select([table.c.id]).where(table.c.id.in_(batch))))
+            db.session.execute(statement)
+    if updated:
+        bump_table_version(table.name)
+    db.session.commit()
+    return updated
+
+
+def delete_rows(model, ids):
+    """Deletes rows of a model by id in one transaction and commits it.
+
+    Each batch of `INSERT_BATCH_SIZE` rows is deleted with one `DELETE ... WHERE id IN (...)` statement. In
+    PostgreSQL the deleted ids are returned by the statement, other databases select them first.
+
+    :param model: Model class of the rows
+    :param ids: Ids of the rows to delete
+    :returns: The ids of the deleted rows. Ids without a row are not included.
+    """
+    table = model.__table__
+    deleted = []
+    for start in range(0, len(ids), INSERT_BATCH_SIZE):
+        batch = ids[start:start + INSERT_BATCH_SIZE]
+        statement = table.delete().where(table.c.id.in_(batch))
+        if returning_supported():
+            deleted.extend(row[0] for row in db.session.execute(statement.returning(table.c.id)))
+        else:
+            deleted.extend(row[0] for row in db.session.execute(select([table.c.id]).where(table.c.id.in_(batch))))
+            db.session.execute(statement)
+    if deleted:
+        bump_table_version(table.name)
+    db.session.commit()
+    return deleted
+
+
+def select_existing_keys(model, keys):
+    """Returns the set of the natural keys (see `upsert_rows`) of existing rows of a model, among the given keys.
+    The keys are looked up in batches of `INSERT_BATCH_SIZE`.
+
+    :param keys: Tuples of the values of the columns in `model.natural_key`
+    """
+    table = model.__table__
+    key_columns = [table.c[key] for key in model.natural_key]
+    keys = list(keys)
+    existing = set()
+    for start in range(0, len(keys), INSERT_BATCH_SIZE):
+        statement = select(key_columns).where(tuple_(*key_columns).in_(keys[start:start + INSERT_BATCH_SIZE]))
+        existing.update(tuple(row) for row in db.session.execute(statement))
+    return existing
+
+
+def upsert_statement(table, keys, rows):
+    """Returns one PostgreSQL `INSERT ... ON CONFLICT (keys) DO UPDATE ... RETURNING id, keys` statement upserting
+    the rows.
+
+    :param keys: Names of the natural key columns, which must have a unique index
+    :param rows: List of dictionaries of column values, with unique natural keys
+    """
+    statement = postgresql_insert(table).values(rows)
+    update_columns = sorted({column for row in rows for column in row if column not in keys})
+    # Rows with only natural key columns update a key column to itself, as DO NOTHING would not return the
+    # existing rows
+    set_ = {column: statement.excluded[column] for column in update_columns or keys[:1]}
+    return statement.on_conflict_do_update(index_elements=keys, set_=set_) \
+        .returning(table.c.id, *[table.c[key] for key in keys])
+
+
+def upsert_rows(model, rows):
+    """Inserts rows of a model, or updates the existing rows with the same natural key, in one transaction and
+    commits it. The natural key is the tuple of columns in `model.natural_key`, which must have a unique index.
+    If several rows have the same natural key the last one is used.
+
+    In PostgreSQL each batch of `INSERT_BATCH_SIZE` rows is upserted with one
+    `INSERT ... ON CONFLICT (natural key) DO UPDATE ... RETURNING id` statement. Other databases select the existing
+    rows of each batch by natural key, then update them with one statement and insert the others.
+
+    :param model: Model class of the rows
+    :param rows: List of dictionaries of column values, including the natural key columns
+    :returns: The ids of the inserted or updated rows, in the same order as the rows
+    """
+    table = model.__table__
+    keys = model.natural_key
+    # Later rows with the same natural key replace earlier ones
+    unique_rows = {}
+    for row in rows:
+        unique_rows[tuple(row[key] for key in keys)] = row
+    unique_rows = list(unique_rows.values())
+    ids_by_key = {}
+    for start in range(0, len(unique_rows), INSERT_BATCH_SIZE):
+        batch = unique_rows[start:start + INSERT_BATCH_SIZE]
+        if returning_supported():
+            for row in db.session.execute(upsert_statement(table, keys, batch)):
+                ids_by_key[tuple(row[key] for key in keys)] = row.id
+        else:
+            key_columns = tuple_(*[table.c[key] for key in keys])
+            batch_keys = [tuple(row[key] for key in keys) for row in batch]
+            existing = db.session.execute(
+                select([table.c.id, *[table.c[key] for key in keys]]).where(key_columns.in_(batch_keys))
+            )
+            for row in existing:
+                ids_by_key[tuple(row[key] for key in keys)] = row.id
+            changes = {}
+            new_rows = []
+            for key, row in zip(batch_keys, batch):
+                if key in ids_by_key:
+                    changes[ids_by_key[key]] = {column: value for column, value in row.items() if column not in keys}
+                else:
+                    new_rows.append(dict(row))
+            changes = {object_id: values for object_id, values in changes.items() if values}
+            if changes:
+                db.session.execute(case_update_statement(table, list(changes), changes))
+            if new_rows:
+                db.session.bulk_insert_mappings(model, new_rows, return_defaults=True)
+                for row in new_rows:
+                    ids_by_key[tuple(row[key] for key in keys)] = row['id']
+    if rows:
+        bump_table_version(table.name)
+    db.session.commit()
+    return [ids_by_key[tuple(row[key] for key in keys)] for row in rows]
+
+
+# Association table of the actors cast in each movie. Links are deleted with their movie or actor.
+movie_actors = db.Table(
+    'movie_actors',
+    db.Column('movie_id', db.Integer, db.ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('actor_id', db.Integer, db.ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True, index=True)
+)
+
+
+def add_movie_actors(movie_id, actor_ids):
+    """Casts actors in a movie in one transaction and commits it. Actors already cast in the movie are skipped.
+
+    In PostgreSQL the links are inserted by one `INSERT ... ON CONFLICT DO NOTHING RETURNING actor_id` statement.
+    Other databases select the existing links first.
+
+    :param actor_ids: Ids of the actors, which must exist
+    :returns: The ids of the newly cast actors
+    """
+    actor_ids = list(dict.fromkeys(actor_ids))
+    rows = [{'movie_id': movie_id, 'actor_id': actor_id} for actor_id in actor_ids]
+    added = []
+    if rows:
+        if returning_supported():
+            statement = postgresql_insert(movie_actors).values(rows).on_conflict_do_nothing()
+            added = [row[0] for row in db.session.execute(statement.returning(movie_actors.c.actor_id))]
+        else:
+            existing = {row[0] for row in db.session.execute(
+                select([movie_actors.c.actor_id]).where(movie_actors.c.movie_id == movie_id)
+                .where(movie_actors.c.actor_id.in_(actor_ids))
+            )}
+            rows = [row for row in rows if row['actor_id'] not in existing]
+            if rows:
+                db.session.execute(movie_actors.insert(), rows)
+            added = [row['actor_id'] for row in rows]
+    if added:
+        bump_table_version(movie_actors.name)
+    db.session.commit()
+    return added
+
+
+def remove_movie_actor(movie_id, actor_id):
+    """Removes an actor from the cast of a movie and commits it.
+
+    :returns: True if the actor was cast in the movie
+    """
+    statement = movie_actors.delete().where(movie_actors.c.movie_id == movie_id) \
+        .where(movie_actors.c.actor_id == actor_id)
+    removed = db.session.execute(statement).rowcount > 0
+    if removed:
+        bump_table_version(movie_actors.name)
+    db.session.commit()
+    return removed
+
+
+@event.listens_for(db.metadata, 'before_create')
+def create_extensions(target, connection, **kwargs):
+    """Creates the PostgreSQL extension pg_trgm of the trigram indexes of the search when the tables are created by
+    `create_all`, like the migrations.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
 class Movie(db.Model):
     """SQLAlchemy model for a movie.
     """
     __tablename__ = 'movies'
 
     id = db.Column(db.Integer, primary_key=True)
+    # Title lookups and sorts use the unique index of the natural key, whose leading column is the title
     title = db.Column(db.String(length=200), nullable=False)
-    release_date = db.Column(db.Date, nullable=False)
+    release_date = db.Column(db.Date, nullable=False, index=True)
+
+    # Actors cast in the movie. The links are deleted by the database, so deleting a movie does not load them
+    actors = db.relationship('Actor', secondary=movie_actors, order_by='Actor.id', passive_deletes=True,
+                             backref=db.backref('movies', order_by='Movie.id', passive_deletes=True))
+
+    # Columns identifying a movie when upserting, must match a unique index
+    natural_key = ('title', 'release_date')
+
+    __table_args__ = (
+        # Index for title prefix (LIKE 'prefix%') filters in PostgreSQL databases with a non C locale
+        db.Index('ix_movies_title_pattern', 'title', postgresql_ops={'title': 'varchar_pattern_ops'}),
+        db.Index('uq_movies_title_release_date', 'title', 'release_date', unique=True),
+        # Trigram index of the title search (ILIKE '%text%') in PostgreSQL
+        db.Index('ix_movies_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
 
     def __init__(self, title=None, release_date=None):
         self.title = title
@@ -36,27 +716,26 @@ class Movie(db.Model):
 
     def format(self):
         """Returns a dictionary with key:value pairs of this object: id, title, release_date.
-        The value release_date is a string with the format "yyyy-mm-dd".
+        The value release_date is a date, encoded as "yyyy-mm-dd" by the JSON encoder of the app.
         """
-        if isinstance(self.release_date, (dt.date, dt.datetime)):
-            json_release_date = self.release_date.strftime('%Y-%m-%d')
-        else:
-            json_release_date = self.release_date
         return {
             'id': self.id,
             'title': self.title,
-            'release_date': json_release_date
+            'release_date': self.release_date
         }
 
     def insert(self):
         db.session.add(self)
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def update(self):
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
 
@@ -67,8 +746,19 @@ class Actor(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(length=200), nullable=False)
-    age = db.Column(db.Integer(), nullable=False)
-    gender = db.Column(db.String(length=100), nullable=True)
+    age = db.Column(db.Integer(), nullable=False, index=True)
+    gender = db.Column(db.String(length=100), nullable=True, index=True)
+
+    # Columns identifying an actor when upserting, must match a unique index
+    natural_key = ('name',)
+
+    __table_args__ = (
+        db.Index('uq_actors_name', 'name', unique=True),
+        # Trigram index of the name search (ILIKE '%text%') in PostgreSQL
+        db.Index('ix_actors_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Index of the sort order of `sort=gender`, which sorts NULL values as empty strings
+        db.Index('ix_actors_gender_sort', func.coalesce(gender, ''), id),
+    )
 
     def __init__(self, name=None, age=None, gender=None):
         self.name = name
@@ -89,11 +779,142 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def update(self):
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_table_version(self.__tablename__)
         db.session.commit()
+
+
+class StatCounter(db.Model):
+    """SQLAlchemy model for a summary counter of GET "/stats", e.g. the number of actors of a gender.
+    The counters are maintained by database triggers on the counted tables, see `create_stats_triggers`.
+    """
+    __tablename__ = 'stat_counters'
+
+    metric = db.Column(db.String(length=50), primary_key=True)
+    bucket = db.Column(db.String(length=200), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StatCounter metric:{self.metric} bucket:{self.bucket} count:{self.count}>'
+
+
+# Width of the age buckets of the actor age distribution
+STATS_AGE_BUCKET = 10
+
+# Summary counters by metric: (counted table, SQL expression of the bucket of a row by dialect name or for all
+# dialects). Rows with a null bucket are not counted.
+STAT_METRICS = {
+    'actors': ('actors', "''"),
+    'actors_gender': ('actors', 'gender'),
+    'actors_age': ('actors', f'CAST((age / {STATS_AGE_BUCKET}) * {STATS_AGE_BUCKET} AS TEXT)'),
+    'movies': ('movies', "''"),
+    'movies_year': ('movies', {'postgresql': "to_char(release_date, 'YYYY')",
+                               'sqlite': "strftime('%Y', release_date)"}),
+}
+
+
+def stat_counters_upsert_sql(table_name, sources, dialect_name):
+    """Returns an `INSERT ... ON CONFLICT DO UPDATE` statement adding the counts of rows of a table to the summary
+    counters, grouped so each counter is updated once.
+
+    :param table_name: Name of the counted table, e.g. 'actors'
+    :param sources: List of tuples (FROM clause of the rows, sign), e.g. [('new_rows', 1), ('old_rows', -1)]
+    :param dialect_name: Database dialect name, e.g. 'postgresql'
+    """
+    selects = []
+    for metric, (table, bucket) in STAT_METRICS.items():
+        if table != table_name:
+            continue
+        if isinstance(bucket, dict):
+            bucket = bucket[dialect_name]
+        for source, sign in sources:
+            selects.append(f"SELECT '{metric}' AS metric, {bucket} AS bucket, {sign} AS delta FROM {source}")
+    return (
+        'INSERT INTO stat_counters (metric, bucket, count) '
+        f'SELECT metric, bucket, SUM(delta) FROM ({" UNION ALL ".join(selects)}) AS deltas '
+        'WHERE bucket IS NOT NULL GROUP BY metric, bucket '
+        'ON CONFLICT (metric, bucket) DO UPDATE SET count = stat_counters.count + excluded.count'
+    )
+
+
+def stats_triggers_ddl(dialect_name):
+    """Returns the statements creating the triggers maintaining the summary counters, for PostgreSQL or SQLite.
+
+    PostgreSQL uses statement level triggers with transition tables, so a bulk write updates each counter once.
+    SQLite only has row level triggers.
+    """
+    statements = []
+    for table_name in sorted({table for table, _ in STAT_METRICS.values()}):
+        if dialect_name == 'postgresql':
+            statements.append(f'''
+                CREATE OR REPLACE FUNCTION update_{table_name}_stats() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        {stat_counters_upsert_sql(table_name, [('new_rows', 1)], dialect_name)};
+                    ELSIF TG_OP = 'UPDATE' THEN
+                        {stat_counters_upsert_sql(table_name, [('new_rows', 1), ('old_rows', -1)], dialect_name)};
+                    ELSE
+                        {stat_counters_upsert_sql(table_name, [('old_rows', -1)], dialect_name)};
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql''')
+            for operation, referencing in (('INSERT', 'NEW TABLE AS new_rows'),
+                                           ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                                           ('DELETE', 'OLD TABLE AS old_rows')):
+                statements.append(f'DROP TRIGGER IF EXISTS {table_name}_stats_{operation.lower()} ON {table_name}')
+                statements.append(
+                    f'CREATE TRIGGER {table_name}_stats_{operation.lower()} AFTER {operation} ON {table_name} '
+                    f'REFERENCING {referencing} FOR EACH STATEMENT EXECUTE PROCEDURE update_{table_name}_stats()'
+                )
+        else:
+            columns = db.metadata.tables[table_name].columns.keys()
+            new_row = '(SELECT ' + ', '.join(f'NEW.{c} AS {c}' for c in columns) + ') AS new_rows'
+            old_row = '(SELECT ' + ', '.join(f'OLD.{c} AS {c}' for c in columns) + ') AS old_rows'
+            for operation, sources in (('INSERT', [(new_row, 1)]),
+                                       ('UPDATE', [(new_row, 1), (old_row, -1)]),
+                                       ('DELETE', [(old_row, -1)])):
+                upsert_sql = stat_counters_upsert_sql(table_name, sources, dialect_name)
+                statements.append(
+                    f'CREATE TRIGGER IF NOT EXISTS {table_name}_stats_{operation.lower()} AFTER {operation} '
+                    f'ON {table_name} FOR EACH ROW BEGIN {upsert_sql}; END'
+                )
+    return statements
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_stats_triggers(target, connection, **kwargs):
+    """Creates the triggers maintaining the summary counters when the tables are created by `create_all`."""
+    for statement in stats_triggers_ddl(connection.dialect.name):
+        connection.execute(statement)
+
+
+def rebuild_stats():
+    """Recomputes all summary counters from the counted tables in one transaction and commits it, e.g. to repair
+    counters that drifted after changes made with the triggers disabled.
+    """
+    dialect_name = db.engine.dialect.name
+    db.session.execute(StatCounter.__table__.delete())
+    for table_name in sorted({table for table, _ in STAT_METRICS.values()}):
+        db.session.execute(stat_counters_upsert_sql(table_name, [(table_name, 1)], dialect_name))
+    # Invalidates the cached responses of the old counters
+    bump_table_version(StatCounter.__tablename__)
+    db.session.commit()
+
+
+def get_stats():
+    """Returns the non zero summary counters as a dictionary of dictionaries of counts by bucket, by metric."""
+    stats = {metric: {} for metric in STAT_METRICS}
+    rows = db.session.query(StatCounter.metric, StatCounter.bucket, StatCounter.count).filter(StatCounter.count != 0)
+    for metric, bucket, count in rows:
+        if metric in stats:
+            stats[metric][bucket] = count
+    return stats
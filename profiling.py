@@ -0,0 +1,139 @@
+import os
+import cProfile
+import glob
+import hmac
+import io
+import itertools
+import pstats
+import random
+import re
+import time
+from collections import defaultdict
+from werkzeug.exceptions import HTTPException
+
+# Directory the profiles are written to. Profiling is disabled if it is not set.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', None)
+# Fraction of requests profiled, from 0 to 1
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Requests with the header `X-Profile: <token>` are always profiled
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', None)
+
+
+def route_name(url_map, environ):
+    """Returns the method and URL rule of a request as a file name, e.g. 'GET_actors_int_actor_id'."""
+    try:
+        rule = url_map.bind_to_environ(environ).match(return_rule=True)[0].rule
+    except HTTPException:
+        rule = 'unmatched'
+    return environ.get('REQUEST_METHOD', 'GET') + '_' + (re.sub(r'[^A-Za-z0-9]+', '_', rule).strip('_') or 'index')
+
+
+class ProfilerMiddleware:
+    """WSGI middleware profiling a sample of the requests of a Flask application with cProfile, including the reading
+    of the response body.
+
+    Each profile is written as `<route>.<time>.<pid>.<sequence>.prof` in pstats format, and its name is returned in
+    the header `X-Profile-Id`. Requests that are not profiled only pay for the sampling decision.
+    """
+
+    def __init__(self, app, directory, sample_rate=0.0, token=None):
+        self.wsgi_app = app.wsgi_app
+        self.url_map = app.url_map
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        # Distinguishes the profiles of requests started in the same millisecond
+        self.sequence = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def should_profile(self, environ):
+        if self.token and hmac.compare_digest(environ.get('HTTP_X_PROFILE', ''), self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+        profile_id = f'{int(time.time() * 1000)}.{os.getpid()}.{next(self.sequence)}'
+
+        def profiled_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Profile-Id', profile_id)], exc_info)
+
+        profile = cProfile.Profile()
+        body = []
+
+        def run():
+            iterable = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body.extend(iterable)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        profile.runcall(run)
+        profile.dump_stats(os.path.join(self.directory, f'{route_name(self.url_map, environ)}.{profile_id}.prof'))
+        return body
+
+
+def init_profiling(app):
+    """Profiles a sample of the requests of an application if `PROFILE_DIR` is set. Otherwise the application is not
+    changed, so profiling has no cost when disabled.
+    """
+    if PROFILE_DIR:
+        app.wsgi_app = ProfilerMiddleware(app, PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_TOKEN)
+
+
+def collapsed_stacks(stats, min_time=1e-5):
+    """Converts profile statistics to collapsed stacks ("caller;callee microseconds" lines) for flame graph tools,
+    e.g. flamegraph.pl or speedscope.
+
+    cProfile only records callers one level up, so the time of a function called from several stacks is split between
+    them in proportion to the time of each caller. Calls taking less than `min_time` seconds in a stack are left out,
+    which also bounds the number of stacks.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, caller_stats in callers.items():
+            callees[caller][func] = caller_stats[3]
+    stacks = defaultdict(float)
+
+    def label(func):
+        filename, line, name = func
+        return f'{name} ({os.path.basename(filename)}:{line})' if line else name
+
+    def walk(func, path, scale):
+        own_time = stats.stats[func][2]
+        path = path + (func,)
+        stacks[path] += own_time * scale
+        for callee, callee_time in callees[func].items():
+            callee_total = stats.stats[callee][3]
+            # Recursive calls are already included in the time of the outer call
+            if callee in path or not callee_total or callee_time * scale < min_time:
+                continue
+            walk(callee, path, callee_time * scale / callee_total)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, (), 1.0)
+    lines = []
+    for path, seconds in stacks.items():
+        microseconds = int(seconds * 1e6)
+        if microseconds > 0:
+            lines.append(';'.join(label(func) for func in path) + f' {microseconds}')
+    return '\n'.join(sorted(lines)) + '\n'
+
+
+def aggregate_profiles(directory, limit=20):
+    """Merges the profiles of each route in a directory. Writes `<route>.collapsed` with the collapsed stacks of the
+    route, and returns a report of the functions with the highest cumulative time of each route.
+    """
+    files_by_route = defaultdict(list)
+    for path in glob.glob(os.path.join(directory, '*.prof')):
+        files_by_route[os.path.basename(path).split('.', 1)[0]].append(path)
+    report = io.StringIO()
+    for route, files in sorted(files_by_route.items()):
+        stats = pstats.Stats(*files, stream=report)
+        with open(os.path.join(directory, f'{route}.collapsed'), 'w') as f:
+            f.write(collapsed_stacks(stats))
+        report.write(f'{route}: {len(files)} profiles\n')
+        stats.sort_stats('cumulative').print_stats(limit)
+    return report.getvalue()
@@ -0,0 +1,73 @@
+import datetime as dt
+from collections import namedtuple
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from sqlalchemy import select
+from models import db, Actor, Movie
+
+
+class ActorRow(NamedTuple):
+    """Actor read by the GET endpoints, with the members of `Actor.format`.
+    Rows are plain tuples built from Core result rows, so unlike `Actor` objects they are not added to the identity map
+    of the session and have no change tracking.
+    """
+    id: int
+    name: str
+    age: int
+    gender: Optional[str]
+
+
+class MovieRow(NamedTuple):
+    """Movie read by the GET endpoints, with the members of `Movie.format`. See `ActorRow`."""
+    id: int
+    title: str
+    release_date: dt.date
+
+
+# Row types of the models
+ROW_TYPES = {Actor: ActorRow, Movie: MovieRow}
+
+
+@lru_cache(maxsize=128)
+def get_row_type(model, fields=None):
+    """Returns the row type of a model, or a row type with only some of its fields.
+
+    :param fields: Tuple of column names, e.g. from the query parameter `fields`. None for all the fields of the row
+        type of the model.
+    """
+    row_type = ROW_TYPES[model]
+    if fields is None or fields == row_type._fields:
+        return row_type
+    return namedtuple(row_type.__name__, fields)
+
+
+def row_columns(model, row_type):
+    """Returns the columns of the table of a model in the order of the fields of a row type."""
+    columns = model.__table__.columns
+    return [columns[name] for name in row_type._fields]
+
+
+def select_rows(model, row_type):
+    """Returns a Core select of the columns of a row type from the table of a model."""
+    return select(row_columns(model, row_type))
+
+
+def fetch_rows(statement, row_type):
+    """Executes a select and returns its result rows as a list of row types. Use `row._asdict()` to format a row."""
+    return [row_type._make(row) for row in db.session.execute(statement)]
+
+
+def stream_rows(statement, row_type, batch_size):
+    """Executes a select with a server side cursor, and returns an iterator of lists of at most `batch_size` rows,
+    as row types.
+    """
+    result = db.session.execute(statement.execution_options(stream_results=True))
+
+    def generate_batches():
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [row_type._make(row) for row in rows]
+
+    return generate_batches()
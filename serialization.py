@@ -0,0 +1,65 @@
+import os
+import re
+import datetime as dt
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    # Optional dependency, the standard library encodes the responses if it is not installed
+    import orjson
+except ImportError:
+    orjson = None
+
+# Library encoding the JSON responses: 'orjson', or 'json' for the standard library. Defaults to orjson if it is
+# installed
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'json' if orjson is None else 'orjson')
+
+# Floats that orjson and the standard library format differently: numbers with an exponent, e.g. 1e16 and 1e+16, and
+# small numbers the standard library writes with an exponent, e.g. 0.00001 and 1e-05
+UNLIKE_FLOAT = re.compile(rb'\de[-\d]|(?<![\d.])0\.0000')
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """JSON encoder of the standard library, encoding dates as strings with the format "yyyy-mm-dd" like orjson."""
+
+    def default(self, o):
+        if isinstance(o, dt.date):
+            return o.isoformat()
+        return super().default(o)
+
+
+class OrjsonJSONEncoder(JSONEncoder):
+    """JSON encoder using orjson for compact output, e.g. from `jsonify`. Lists of rows, and their dates, are encoded
+    natively instead of value by value in Python.
+
+    The output is byte for byte the output of `JSONEncoder`, as the standard library encodes the objects that orjson
+    encodes differently: indented output, non ASCII output if `ensure_ascii` is set, floats written with an exponent
+    by either library, and objects orjson can't encode, e.g. integers over 64 bits or keys that aren't strings. NaN and
+    infinite floats are the exception, encoded as null instead of invalid JSON.
+    """
+
+    def encode(self, o):
+        if self.indent is None and self.item_separator == ',' and self.key_separator == ':':
+            # orjson doesn't sort the fields of dataclasses, so they are converted to dictionaries by `default` first
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS if self.sort_keys else 0
+            try:
+                data = orjson.dumps(o, default=self.default, option=option)
+            except TypeError:
+                pass
+            else:
+                if not (self.ensure_ascii and not data.isascii()) and UNLIKE_FLOAT.search(data) is None:
+                    return data.decode()
+        return super().encode(o)
+
+
+def get_json_encoder(provider=JSON_PROVIDER):
+    """Returns the JSON encoder class of a provider, 'orjson' or 'json'.
+
+    :raises ValueError: If the provider is unknown, or is 'orjson' and orjson is not installed.
+    """
+    if provider == 'json':
+        return JSONEncoder
+    if provider == 'orjson':
+        if orjson is None:
+            raise ValueError('JSON_PROVIDER is orjson, but orjson is not installed')
+        return OrjsonJSONEncoder
+    raise ValueError(f'Unknown JSON_PROVIDER {provider!r}, expected orjson or json')
@@ -1,52 +1,239 @@
-import os
+import json
 import pytest
+from sqlalchemy import event
 from app import create_app
-from models import Actor, Movie
+from models import Actor, Movie, StatCounter, rebuild_stats
 
 
-@pytest.fixture
-def client():
-    app = create_app(test_config=True)
-    # Build up test database from scratch
-    app.db.drop_all()
-    app.db.create_all()
-    client = app.test_client()
+def test_get_actors(client, casting_assistant_jwt):
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), list)
+
 
-    yield client
+def test_get_actors_fail_auth(client):
+    # Get actors with authorization
+    response = client.get('/actors')
+    assert response.status_code == 401
 
-    # Drop all tables from the database after testing
-    app.db.drop_all()
 
+def test_get_actors_paginated(client, casting_assistant_jwt, casting_director_jwt):
+    for i in range(3):
+        client.post('/actors',
+                    json={'name': f'Actor {i}', 'age': 30 + i},
+                    headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors?limit=2',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [a['name'] for a in response_data['actors']] == ['Actor 0', 'Actor 1']
+    assert response_data['next'] == response_data['actors'][-1]['id']
 
-@pytest.fixture
-def casting_assistant_jwt():
-    jwt = os.environ['TEST_CASTING_ASSISTANT_JWT']
-    return jwt
+    # Get the next page
+    response = client.get(f'/actors?limit=2&after_id={response_data["next"]}',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [a['name'] for a in response_data['actors']] == ['Actor 2']
+    assert response_data['next'] is None
 
 
-@pytest.fixture
-def casting_director_jwt():
-    jwt = os.environ['TEST_CASTING_DIRECTOR_JWT']
-    return jwt
+def test_get_actors_paginated_fail(client, casting_assistant_jwt):
+    # Limit is not an integer
+    response = client.get('/actors?limit=abc',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 400
+    # Limit is out of range
+    response = client.get('/actors?limit=0',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 422
 
 
-@pytest.fixture
-def executive_producer_jwt():
-    jwt = os.environ['TEST_EXECUTIVE_PRODUCER_JWT']
-    return jwt
+def test_get_actors_stream(client, casting_assistant_jwt, casting_director_jwt):
+    for i in range(3):
+        client.post('/actors',
+                    json={'name': f'Actor {i}', 'age': 30 + i},
+                    headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    all_actors = response.get_json()
+    # Stream a JSON array
+    response = client.get('/actors?stream=1',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == all_actors
+    # Stream newline delimited JSON
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}',
+                                   'accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == all_actors
 
 
-def test_get_actors(client, casting_assistant_jwt):
+def test_get_actors_fields(client, casting_assistant_jwt, casting_director_jwt):
+    client.post('/actors',
+                json={'name': 'John', 'age': 40, 'gender': 'M'},
+                headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors?fields=name',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert len(response_data) == 1
+    assert set(response_data[0]) == {'id', 'name'}
+    assert response_data[0]['name'] == 'John'
+
+    # Repeated fields
+    for fields in ('name,name', 'id,name,id'):
+        response = client.get(f'/actors?fields={fields}',
+                              headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+        assert response.status_code == 200
+        assert set(response.get_json()[0]) == {'id', 'name'}
+
+    # Unknown field
+    response = client.get('/actors?fields=name,salary',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 400
+
+
+def test_get_actors_filter_sort(client, casting_assistant_jwt, casting_director_jwt):
+    for name, age, gender in [('A', 20, 'M'), ('B', 35, 'F'), ('C', 50, 'F'), ('D', 40, 'F')]:
+        client.post('/actors',
+                    json={'name': name, 'age': age, 'gender': gender},
+                    headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors?age_min=30&gender=F&sort=-age',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert [a['name'] for a in response.get_json()] == ['C', 'D', 'B']
+
+    # Paginate through a sorted list
+    response = client.get('/actors?age_min=30&sort=-age&limit=2',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    response_data = response.get_json()
+    assert [a['name'] for a in response_data['actors']] == ['C', 'D']
+    response = client.get(f'/actors?age_min=30&sort=-age&limit=2&after_id={response_data["next"]}',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    response_data = response.get_json()
+    assert [a['name'] for a in response_data['actors']] == ['B']
+    assert response_data['next'] is None
+
+    # Missing genders sort first
+    client.post('/actors',
+                json={'name': 'E', 'age': 60},
+                headers={'authorization': f'Bearer {casting_director_jwt}'})
+    names = []
+    after = ''
+    while after is not None:
+        response = client.get(f'/actors?sort=gender&limit=2{after}',
+                              headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+        response_data = response.get_json()
+        names.extend(a['name'] for a in response_data['actors'])
+        after = None if response_data['next'] is None else f'&after_id={response_data["next"]}'
+    assert names == ['E', 'B', 'C', 'D', 'A']
+
+    # Invalid sort column
+    for sort in ('salary', '--age'):
+        response = client.get(f'/actors?sort={sort}',
+                              headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+        assert response.status_code == 400
+
+    # Unknown cursor of a sorted list
+    response = client.get('/actors?sort=-age&limit=2&after_id=1000',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 400
+
+
+def test_get_actors_cache_invalidated(client, casting_assistant_jwt, casting_director_jwt):
+    response = client.post('/actors',
+                           json={'name': 'John', 'age': 40},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    actor_id = response.get_json()['id']
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.headers['X-Cache'] == 'MISS'
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_json()[0]['age'] == 40
+
+    # Updating the actor invalidates the cached response
+    client.patch(f'/actors/{actor_id}',
+                 json={'age': 41},
+                 headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()[0]['age'] == 41
+    stats = client.application.response_cache.stats()
+    assert stats['get_actors']['hits'] == 1
+    assert stats['get_actors']['misses'] == 2
+
+
+def test_get_actors_etag(client, casting_assistant_jwt, casting_director_jwt):
+    response = client.post('/actors',
+                           json={'name': 'John', 'age': 40},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    actor_id = response.get_json()['id']
     response = client.get('/actors',
                           headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    etag = response.headers['ETag']
+    # Not modified
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}',
+                                   'if-none-match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    # Modified by another request
+    client.patch(f'/actors/{actor_id}',
+                 json={'age': 41},
+                 headers={'authorization': f'Bearer {casting_director_jwt}'})
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}',
+                                   'if-none-match': etag})
     assert response.status_code == 200
-    assert isinstance(response.get_json(), list)
+    assert response.headers['ETag'] != etag
+    assert response.get_json()[0]['age'] == 41
 
 
-def test_get_actors_fail_auth(client):
-    # Get actors with authorization
-    response = client.get('/actors')
-    assert response.status_code == 401
+def test_get_actor_if_none_match_star(client, casting_assistant_jwt, casting_director_jwt):
+    response = client.post('/actors',
+                           json={'name': 'John', 'age': 40},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    actor_id = response.get_json()['id']
+    # Any ETag matches an existing actor, cached or not
+    for _ in range(2):
+        response = client.get(f'/actors/{actor_id}',
+                              headers={'authorization': f'Bearer {casting_assistant_jwt}', 'if-none-match': '*'})
+        assert response.status_code == 304
+        client.get(f'/actors/{actor_id}', headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    response = client.get('/actors/99999',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}', 'if-none-match': '*'})
+    assert response.status_code == 404
+
+
+def test_get_actor(client, casting_assistant_jwt, casting_director_jwt):
+    response = client.post('/actors',
+                           json={'name': 'John', 'age': 40, 'gender': 'M'},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    actor_id = response.get_json()['id']
+    response = client.get(f'/actors/{actor_id}',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == {'id': actor_id, 'name': 'John', 'age': 40, 'gender': 'M'}
+
+    response = client.get(f'/actors/{actor_id}?fields=age',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == {'id': actor_id, 'age': 40}
+
+
+def test_get_actor_fail_does_not_exist(client, casting_assistant_jwt):
+    response = client.get('/actors/99999',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 404
 
 
 def test_get_movies(client, casting_assistant_jwt):
@@ -56,6 +243,175 @@ def test_get_movies(client, casting_assistant_jwt):
     assert isinstance(response.get_json(), list)
 
 
+def test_get_movies_paginated(client, casting_assistant_jwt, executive_producer_jwt):
+    for i in range(3):
+        client.post('/movies',
+                    json={'title': f'Movie {i}', 'release_date': '2021-01-01'},
+                    headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    response = client.get('/movies?limit=2',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [m['title'] for m in response_data['movies']] == ['Movie 0', 'Movie 1']
+
+    response = client.get(f'/movies?limit=2&after_id={response_data["next"]}',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [m['title'] for m in response_data['movies']] == ['Movie 2']
+    assert response_data['next'] is None
+
+
+def test_get_movies_filter_sort(client, casting_assistant_jwt, executive_producer_jwt):
+    for title, release_date in [('Star A', '2020-01-01'), ('Star B', '2021-06-01'), ('Moon', '2021-01-01')]:
+        client.post('/movies',
+                    json={'title': title, 'release_date': release_date},
+                    headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    response = client.get('/movies?title_prefix=Star&sort=-release_date',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert [m['title'] for m in response.get_json()] == ['Star B', 'Star A']
+
+    response = client.get('/movies?release_date_from=2021-01-01&release_date_to=2021-12-31&sort=title',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert [m['title'] for m in response.get_json()] == ['Moon', 'Star B']
+
+    # Invalid date format
+    response = client.get('/movies?release_date_from=01-01-2021',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 400
+
+
+def test_get_movie(client, casting_assistant_jwt, executive_producer_jwt):
+    response = client.post('/movies',
+                           json={'title': 'Movie A', 'release_date': '2021-01-01'},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    movie_id = response.get_json()['id']
+    response = client.get(f'/movies/{movie_id}?fields=release_date',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == {'id': movie_id, 'release_date': '2021-01-01'}
+
+
+def test_get_movie_fail_does_not_exist(client, casting_assistant_jwt):
+    response = client.get('/movies/99999',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 404
+
+
+def test_movie_cast(client, casting_assistant_jwt, executive_producer_jwt):
+    movie_id = client.post('/movies',
+                           json={'title': 'Movie A', 'release_date': '2021-01-01'},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'}).get_json()['id']
+    response = client.put('/actors',
+                          json=[{'name': 'John', 'age': 40}, {'name': 'Jane', 'age': 30}],
+                          headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    actor_ids = [u['id'] for u in response.get_json()['upserted']]
+    response = client.post(f'/movies/{movie_id}/actors',
+                           json={'actor_ids': actor_ids},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == {'added': actor_ids}
+
+    response = client.get(f'/movies/{movie_id}/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert [a['name'] for a in response.get_json()] == ['John', 'Jane']
+    response = client.get(f'/actors/{actor_ids[0]}/movies',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert [m['title'] for m in response.get_json()] == ['Movie A']
+
+    # Remove an actor from the cast, then delete the other actor
+    response = client.delete(f'/movies/{movie_id}/actors/{actor_ids[0]}',
+                             headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    client.delete(f'/actors/{actor_ids[1]}',
+                  headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    response = client.get(f'/movies/{movie_id}/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.get_json() == []
+
+
+def test_movie_cast_fail(client, casting_director_jwt, executive_producer_jwt):
+    movie_id = client.post('/movies',
+                           json={'title': 'Movie A', 'release_date': '2021-01-01'},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'}).get_json()['id']
+    # Actor does not exist
+    response = client.post(f'/movies/{movie_id}/actors',
+                           json={'actor_ids': [99999]},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 422
+    # Movie does not exist
+    response = client.get('/movies/99999/actors',
+                          headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 404
+    # Actor not cast in the movie
+    response = client.delete(f'/movies/{movie_id}/actors/99999',
+                             headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 404
+    # Invalid body
+    response = client.post(f'/movies/{movie_id}/actors',
+                           json={'actor_ids': 'all'},
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 400
+
+
+def test_get_movies_expand_cast_query_count(client, casting_assistant_jwt, executive_producer_jwt):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def get_movies_expanded():
+        del statements[:]
+        event.listen(client.application.db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = client.get('/movies?expand=cast&limit=100',
+                                  headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+        finally:
+            event.remove(client.application.db.engine, 'before_cursor_execute', count_statement)
+        assert response.status_code == 200
+        return response.get_json()['movies'], len(statements)
+
+    def add_movies(titles):
+        movies = client.put('/movies',
+                            json=[{'title': title, 'release_date': '2021-01-01'} for title in titles],
+                            headers={'authorization': f'Bearer {executive_producer_jwt}'}).get_json()['upserted']
+        actors = client.put('/actors',
+                            json=[{'name': f'Actor of {title}', 'age': 30} for title in titles],
+                            headers={'authorization': f'Bearer {executive_producer_jwt}'}).get_json()['upserted']
+        for movie, actor in zip(movies, actors):
+            client.post(f'/movies/{movie["id"]}/actors',
+                        json={'actor_ids': [actor['id']]},
+                        headers={'authorization': f'Bearer {executive_producer_jwt}'})
+
+    add_movies(['Movie A', 'Movie B'])
+    movies, small_count = get_movies_expanded()
+    assert [len(m['cast']) for m in movies] == [1, 1]
+
+    add_movies(['Movie A', 'Movie B', 'Movie C', 'Movie D', 'Movie E', 'Movie F'])
+    movies, large_count = get_movies_expanded()
+    assert len(movies) == 6
+    # The cast of every movie is loaded by one query, however many movies there are
+    assert large_count == small_count
+
+
+def test_expand_requires_view_permission_of_related_objects(client, jwks, executive_producer_jwt):
+    actors_viewer_jwt = jwks.mint_token('auth0|actors-viewer', ['view:actors'])
+    movies_viewer_jwt = jwks.mint_token('auth0|movies-viewer', ['view:movies'])
+    # Cached by a token with both permissions first, the cached response must not be returned without them
+    for path in ('/actors?expand=movies', '/movies?expand=cast'):
+        response = client.get(path, headers={'authorization': f'Bearer {executive_producer_jwt}'})
+        assert response.status_code == 200
+    response = client.get('/actors?expand=movies', headers={'authorization': f'Bearer {actors_viewer_jwt}'})
+    assert response.status_code == 403
+    response = client.get('/movies?expand=cast', headers={'authorization': f'Bearer {movies_viewer_jwt}'})
+    assert response.status_code == 403
+    response = client.get('/actors', headers={'authorization': f'Bearer {actors_viewer_jwt}'})
+    assert response.status_code == 200
+
+
 def test_get_movies_fail_auth(client):
     # Get movies with authorization
     response = client.get('/movies')
@@ -109,6 +465,105 @@ def test_post_actor_fail_permission(client, casting_assistant_jwt):
     assert response.status_code == 403
 
 
+def test_post_actors_bulk(client, casting_director_jwt):
+    body = [
+        {'name': 'John', 'age': 40, 'gender': 'M'},
+        {'name': 'Missing age'},
+        {'name': 'Negative age', 'age': -1},
+        {'name': 'Jane', 'age': 30}
+    ]
+    response = client.post('/actors/bulk',
+                           json=body,
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [c['index'] for c in response_data['created']] == [0, 3]
+    assert [(e['index'], e['error']) for e in response_data['errors']] == [(1, 400), (2, 422)]
+    actor = Actor.query.get(response_data['created'][1]['id'])
+    client.application.db.session.close()
+    assert actor.name == 'Jane'
+
+
+def test_post_actors_bulk_conflicts(client, casting_director_jwt):
+    client.post('/actors',
+                json={'name': 'John', 'age': 40},
+                headers={'authorization': f'Bearer {casting_director_jwt}'})
+    # Names of an existing actor, or of an earlier actor of the request, are errors
+    body = [
+        {'name': 'John', 'age': 41},
+        {'name': 'Jane', 'age': 30},
+        {'name': 'Missing age'},
+        {'name': 'Jane', 'age': 31}
+    ]
+    response = client.post('/actors/bulk',
+                           json=body,
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [c['index'] for c in response_data['created']] == [1]
+    assert [(e['index'], e['error']) for e in response_data['errors']] == [(0, 409), (2, 400), (3, 409)]
+
+    # An existing name fails a single create
+    response = client.post('/actors',
+                           json={'name': 'Jane', 'age': 30},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 422
+
+
+def test_post_actors_bulk_ndjson(client, casting_director_jwt):
+    body = '{"name": "John", "age": 40}\n{"name": "Jane", "age": 30}\n'
+    response = client.post('/actors/bulk',
+                           data=body,
+                           content_type='application/x-ndjson',
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    assert len(response.get_json()['created']) == 2
+
+
+def test_post_actors_bulk_fail(client, casting_director_jwt, casting_assistant_jwt):
+    # Body is not an array
+    response = client.post('/actors/bulk',
+                           json={'name': 'John', 'age': 40},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 400
+    # Missing permission
+    response = client.post('/actors/bulk',
+                           json=[{'name': 'John', 'age': 40}],
+                           headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 403
+
+
+def test_put_actors(client, casting_director_jwt, casting_assistant_jwt):
+    response = client.put('/actors',
+                          json=[{'name': 'John', 'age': 40}, {'name': 'Jane', 'age': 30}],
+                          headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    john_id = response.get_json()['upserted'][0]['id']
+
+    # Repeating the request updates the existing actors instead of creating duplicates
+    response = client.put('/actors',
+                          json=[{'name': 'John', 'age': 41, 'gender': 'M'}, {'name': 'Alice', 'age': 25}],
+                          headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data['upserted'][0] == {'index': 0, 'id': john_id}
+    assert response_data['errors'] == []
+    response = client.get('/actors',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert [(a['name'], a['age']) for a in response.get_json()] == [('John', 41), ('Jane', 30), ('Alice', 25)]
+
+    # Creating a duplicate actor fails
+    response = client.post('/actors',
+                           json={'name': 'John', 'age': 42},
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 422
+    # Missing permission
+    response = client.put('/actors',
+                          json=[{'name': 'John', 'age': 40}],
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 403
+
+
 def test_post_movie(client, executive_producer_jwt):
     body = {'title': 'Movie A', 'release_date': '2021-01-01'}
     response = client.post('/movies',
@@ -119,6 +574,43 @@ def test_post_movie(client, executive_producer_jwt):
     assert response_data['id']
 
 
+def test_post_movies_bulk(client, executive_producer_jwt):
+    body = [
+        {'title': 'Movie A', 'release_date': '2021-01-01'},
+        {'title': 'Movie B', 'release_date': '01-02-2020'}
+    ]
+    response = client.post('/movies/bulk',
+                           json=body,
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [c['index'] for c in response_data['created']] == [0]
+    assert response_data['errors'] == [{'index': 1, 'error': 422, 'message': 'unprocessable'}]
+
+
+def test_post_movies_bulk_upsert(client, executive_producer_jwt, casting_director_jwt):
+    body = [
+        {'title': 'Movie A', 'release_date': '2021-01-01'},
+        {'title': 'Movie A', 'release_date': '2022-01-01'}
+    ]
+    response = client.post('/movies/bulk?upsert=1',
+                           json=body,
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    ids = [u['id'] for u in response.get_json()['upserted']]
+    assert len(set(ids)) == 2
+    response = client.post('/movies/bulk?upsert=1',
+                           json=body,
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert [u['id'] for u in response.get_json()['upserted']] == ids
+
+    # Upserting requires the update permission
+    response = client.post('/movies/bulk?upsert=1',
+                           json=body,
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 403
+
+
 def test_post_movie_fail(client, executive_producer_jwt):
     # Missing body
     response = client.post('/movies',
@@ -227,6 +719,35 @@ def test_patch_actor_fail_does_not_exist(client, casting_director_jwt):
     assert response.status_code == 404
 
 
+def test_patch_actors_bulk(client, casting_director_jwt):
+    response = client.post('/actors/bulk',
+                           json=[{'name': 'A', 'age': 20}, {'name': 'B', 'age': 30}],
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    first_id, second_id = [c['id'] for c in response.get_json()['created']]
+    body = [
+        {'id': first_id, 'changes': {'age': 21}},
+        {'id': second_id, 'changes': {'name': 'New B', 'gender': 'F'}},
+        {'id': 99999, 'changes': {'age': 1}},
+        {'id': first_id, 'changes': {'age': -1}},
+        # Booleans are not ids
+        {'id': False, 'changes': {'age': 50}}
+    ]
+    response = client.patch('/actors',
+                            json=body,
+                            headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data['updated'] == [first_id, second_id]
+    assert response_data['missing'] == [99999]
+    assert response_data['errors'] == [{'index': 3, 'error': 422, 'message': 'unprocessable'},
+                                       {'index': 4, 'error': 400, 'message': 'bad request'}]
+    first = Actor.query.get(first_id)
+    second = Actor.query.get(second_id)
+    client.application.db.session.close()
+    assert first.age == 21
+    assert (second.name, second.gender, second.age) == ('New B', 'F', 30)
+
+
 def test_patch_actor_fail_auth(client):
     actor_id = 1
     response = client.patch(f'/actors/{actor_id}')
@@ -336,6 +857,26 @@ def test_delete_actor(client, casting_director_jwt, executive_producer_jwt):
     assert actor is None
 
 
+def test_delete_actors_bulk(client, casting_director_jwt):
+    response = client.post('/actors/bulk',
+                           json=[{'name': 'A', 'age': 20}, {'name': 'B', 'age': 30}],
+                           headers={'authorization': f'Bearer {casting_director_jwt}'})
+    ids = [c['id'] for c in response.get_json()['created']]
+    response = client.delete(f'/actors?ids={ids[0]},{ids[1]},99999',
+                             headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data['deleted'] == ids
+    assert response_data['missing'] == [99999]
+    assert Actor.query.filter(Actor.id.in_(ids)).count() == 0
+    client.application.db.session.close()
+
+    # Invalid ids
+    response = client.delete('/actors?ids=a,b',
+                             headers={'authorization': f'Bearer {casting_director_jwt}'})
+    assert response.status_code == 400
+
+
 def test_delete_actor_fail_does_not_exist(client, executive_producer_jwt):
     response = client.delete('/actors/99999',
                              headers={'authorization': f'Bearer {executive_producer_jwt}'})
@@ -374,6 +915,22 @@ def test_delete_movie(client, executive_producer_jwt):
     assert movie is None
 
 
+def test_patch_and_delete_movies_bulk(client, executive_producer_jwt):
+    response = client.post('/movies/bulk',
+                           json=[{'title': 'A', 'release_date': '2020-01-01'}],
+                           headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    movie_id = response.get_json()['created'][0]['id']
+    response = client.patch('/movies',
+                            json=[{'id': movie_id, 'changes': {'release_date': '2021-02-03'}}],
+                            headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == [movie_id]
+    response = client.delete(f'/movies?ids={movie_id}',
+                             headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == {'deleted': [movie_id], 'missing': []}
+
+
 def test_delete_movie_fail_does_not_exist(client, executive_producer_jwt):
     response = client.delete('/movies/99999',
                              headers={'authorization': f'Bearer {executive_producer_jwt}'})
@@ -393,6 +950,146 @@ def test_delete_movie_fail_permission(client, casting_assistant_jwt):
     assert response.status_code == 403
 
 
+def test_get_stats(client, casting_assistant_jwt, executive_producer_jwt):
+    response = client.put('/actors',
+                          json=[{'name': 'A', 'age': 25, 'gender': 'F'}, {'name': 'B', 'age': 31},
+                                {'name': 'C', 'age': 38}],
+                          headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    actor_id = response.get_json()['upserted'][2]['id']
+    response = client.put('/movies',
+                          json=[{'title': 'X', 'release_date': '2020-01-01'},
+                                {'title': 'Y', 'release_date': '1999-05-01'}],
+                          headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    movie_id = response.get_json()['upserted'][1]['id']
+    client.patch('/actors',
+                 json=[{'id': actor_id, 'changes': {'gender': 'M', 'age': 41}}],
+                 headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    client.delete(f'/movies/{movie_id}',
+                  headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    expected = {
+        'actors': {
+            'total': 3,
+            'by_gender': [{'gender': 'F', 'count': 1}, {'gender': 'M', 'count': 1}, {'gender': None, 'count': 1}],
+            'by_age': [{'age_min': 20, 'age_max': 29, 'count': 1},
+                       {'age_min': 30, 'age_max': 39, 'count': 1},
+                       {'age_min': 40, 'age_max': 49, 'count': 1}]
+        },
+        'movies': {
+            'total': 1,
+            'by_release_year': [{'year': 2020, 'count': 1}]
+        }
+    }
+    response = client.get('/stats',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    assert response.get_json() == expected
+
+    # Rebuilding the counters after they drift
+    db = client.application.db
+    db.session.query(StatCounter).delete()
+    db.session.commit()
+    rebuild_stats()
+    response = client.get('/stats',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json() == expected
+
+
+@pytest.mark.usefixtures('app')
+def test_get_actors_from_replica(tmp_path, casting_assistant_jwt, casting_director_jwt):
+    # The replica is a separate database that is not replicated, so reads show which database was used
+    app = create_app(test_config={'replica_urls': [f'sqlite:///{tmp_path}/replica.db',
+                                                   f'sqlite:///{tmp_path}/missing/replica.db']})
+    # The schema of the test database exists unless it is in memory, which is not shared between apps
+    app.db.create_all()
+    replica = app.replica_router.engines[0]
+    app.db.metadata.create_all(replica)
+    replica.execute(Actor.__table__.insert(), {'name': 'Replica', 'age': 40})
+    client = app.test_client()
+
+    client.post('/actors',
+                json={'name': 'Primary', 'age': 30},
+                headers={'authorization': f'Bearer {casting_director_jwt}'})
+    for _ in range(2):
+        # The unreachable replica is taken out of rotation
+        response = client.get('/actors',
+                              headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+        assert [a['name'] for a in response.get_json()] == ['Replica']
+    assert [r['healthy'] for r in app.replica_router.stats()] == [True, False]
+
+    # Reads after a write in the same session use the primary
+    with app.test_request_context('/actors'):
+        app.db.session.execute(Actor.__table__.insert(), {'name': 'Written', 'age': 20})
+        assert [a.name for a in Actor.query.order_by(Actor.id)] == ['Primary', 'Written']
+        app.db.session.rollback()
+    # This app writes outside of the test transactions, so remove the committed actor
+    Actor.query.filter_by(name='Primary').delete()
+    app.db.session.commit()
+
+
+def test_search(client, casting_assistant_jwt, executive_producer_jwt):
+    client.post('/actors',
+                json={'name': 'Tom Hanks', 'age': 64},
+                headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    client.post('/actors',
+                json={'name': 'Emma Stone', 'age': 32},
+                headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    client.post('/movies',
+                json={'title': 'Tomorrow Never Dies', 'release_date': '1997-12-12'},
+                headers={'authorization': f'Bearer {executive_producer_jwt}'})
+    response = client.get('/search?q=tom',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    response_data = response.get_json()
+    results = {(r['type'], r.get('name') or r.get('title')) for r in response_data['results']}
+    assert results == {('actor', 'Tom Hanks'), ('movie', 'Tomorrow Never Dies')}
+    ranks = [r['rank'] for r in response_data['results']]
+    assert ranks == sorted(ranks, reverse=True)
+
+    # Paginate the results
+    response = client.get('/search?q=tom&limit=1',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    response_data = response.get_json()
+    assert len(response_data['results']) == 1
+    assert response_data['next'] == 1
+
+
+def test_search_fail(client, casting_assistant_jwt):
+    # Missing search string
+    response = client.get('/search',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 400
+    # Limit out of range
+    response = client.get('/search?q=tom&limit=1000',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 422
+
+
+def test_search_fail_auth(client):
+    response = client.get('/search?q=tom')
+    assert response.status_code == 401
+
+
+def test_query_count_headers(client, casting_assistant_jwt):
+    response = client.get('/actors?limit=10',
+                          headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    assert response.status_code == 200
+    # The table versions of the cache key and the page
+    assert response.headers['X-DB-Queries'] == '2'
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+
+
+def test_metrics(client, casting_assistant_jwt):
+    client.get('/actors', headers={'authorization': f'Bearer {casting_assistant_jwt}'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/actors",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/actors"}' in body
+    assert 'http_request_db_duration_seconds_count{route="/actors"}' in body
+
+
 def test_404_error(client):
     response = client.get('/doesnotexist')
     assert response.status_code == 404
@@ -0,0 +1,160 @@
+import time
+import pytest
+import auth
+from auth import AuthError, JWKSKeyStore, TokenCache, VerifiedToken, compile_permission_check
+
+
+class FakeKeyStore(JWKSKeyStore):
+    """Key store that returns a fixed key set instead of downloading it."""
+
+    def __init__(self, kids, **kwargs):
+        super().__init__('https://example.com/.well-known/jwks.json', **kwargs)
+        self.kids = kids
+
+    def fetch(self):
+        return {kid: {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'} for kid in self.kids}
+
+
+def test_jwks_store_caches_keys():
+    store = FakeKeyStore(['a'])
+    assert store.get_key('a')['kid'] == 'a'
+    assert store.get_key('a')['kid'] == 'a'
+    assert store.fetches == 1
+    assert store.hits == 2
+
+
+def test_jwks_store_refetches_unknown_kid_once():
+    store = FakeKeyStore(['a'], min_refresh_interval=0.5)
+    store.get_key('a')
+    time.sleep(0.5)
+    # Key rotated, the unknown kid triggers a refetch
+    store.kids = ['b']
+    assert store.get_key('b')['kid'] == 'b'
+    assert store.fetches == 2
+    # Refetches are rate limited
+    assert store.get_key('c') is None
+    assert store.get_key('c') is None
+    assert store.fetches == 2
+    assert store.misses == 2
+
+
+def test_jwks_store_serves_stale_keys_while_refreshing():
+    store = FakeKeyStore(['a'], ttl=0, min_refresh_interval=0)
+    store.get_key('a')
+    store.kids = ['a', 'b']
+    # Stale keys are served immediately, the refresh runs in the background
+    assert store.get_key('a')['kid'] == 'a'
+    for _ in range(100):
+        if store.fetches == 2:
+            break
+        time.sleep(0.01)
+    assert store.fetches == 2
+    assert store.stats()['keys'] == 2
+
+
+def test_jwks_store_keeps_keys_when_fetch_fails():
+    store = FakeKeyStore(['a'], min_refresh_interval=0)
+    store.get_key('a')
+
+    def fail():
+        raise OSError('network down')
+    store.fetch = fail
+    assert store.refresh() is False
+    assert store.get_key('a')['kid'] == 'a'
+    assert store.fetch_errors >= 1
+
+
+def test_jwks_store_rate_limits_failing_stale_refreshes():
+    store = FakeKeyStore(['a'], ttl=0, min_refresh_interval=60)
+    store.get_key('a')
+    attempts = []
+
+    def fail():
+        attempts.append(time.monotonic())
+        raise OSError('network down')
+    store.fetch = fail
+    # The last attempt is older than the interval: one background refresh, which fails
+    store._last_fetch_attempt -= 60
+    for _ in range(10):
+        assert store.get_key('a')['kid'] == 'a'
+    for _ in range(100):
+        if store.fetch_errors:
+            break
+        time.sleep(0.01)
+    for _ in range(10):
+        assert store.get_key('a')['kid'] == 'a'
+    assert len(attempts) == 1
+
+
+def test_token_cache_hit_and_lru_eviction():
+    cache = TokenCache(maxsize=2)
+    exp = time.time() + 60
+    cache.set('t1', VerifiedToken({'sub': '1', 'exp': exp}, None))
+    cache.set('t2', VerifiedToken({'sub': '2', 'exp': exp}, None))
+    assert cache.get('t1').payload['sub'] == '1'
+    # t2 is the least recently used token
+    cache.set('t3', VerifiedToken({'sub': '3', 'exp': exp}, None))
+    assert cache.get('t2') is None
+    assert cache.get('t3').payload['sub'] == '3'
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+
+def test_token_cache_drops_expired_tokens():
+    cache = TokenCache()
+    cache.set('expired', VerifiedToken({'exp': time.time() - 1}, None))
+    cache.set('no-exp', VerifiedToken({'sub': '1'}, None))
+    assert cache.get('expired') is None
+    assert cache.get('no-exp') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_token_cache_instrumentation_hook():
+    events = []
+    auth.instrumentation_hooks.append(events.append)
+    try:
+        cache = TokenCache()
+        cache.get('t1')
+        cache.set('t1', VerifiedToken({'exp': time.time() + 60}, None))
+        cache.get('t1')
+    finally:
+        auth.instrumentation_hooks.remove(events.append)
+    assert events == ['token_cache.miss', 'token_cache.hit']
+
+
+def test_key_rotation_clears_token_cache():
+    store = FakeKeyStore(['a'])
+    cache = TokenCache()
+    store.rotation_listeners.append(cache.clear)
+    store.get_key('a')
+    cache.set('t1', VerifiedToken({'exp': time.time() + 60}, None))
+    store.kids = ['b']
+    store.refresh()
+    assert cache.get('t1') is None
+
+
+def test_permission_check_single_permission():
+    check = compile_permission_check('view:actors')
+    check(frozenset(['view:actors', 'view:movies']))
+    with pytest.raises(AuthError) as e:
+        check(frozenset(['view:movies']))
+    assert e.value.status_code == 403
+    with pytest.raises(AuthError) as e:
+        check(None)
+    assert e.value.status_code == 401
+    # No permission required
+    compile_permission_check()(None)
+
+
+def test_permission_check_all_of_and_any_of():
+    check_all = compile_permission_check(['add:actor', 'update:actor'])
+    check_all(frozenset(['add:actor', 'update:actor', 'view:actors']))
+    with pytest.raises(AuthError):
+        check_all(frozenset(['add:actor']))
+
+    check_any = compile_permission_check(any_of=['view:actors', 'view:movies'])
+    check_any(frozenset(['view:movies']))
+    with pytest.raises(AuthError):
+        check_any(frozenset(['add:actor']))
@@ -0,0 +1,35 @@
+import pytest
+from jose import jwt
+from auth import JWKSKeyStore
+from benchmark.jwks import LocalJWKS
+from benchmark.runner import Result, compare, plan_requests, summarize
+from benchmark.scenarios import Dataset
+
+
+def test_local_jwks_serves_the_key_of_its_tokens():
+    jwks = LocalJWKS('https://benchmark.local/', 'benchmark', key_size=1024).start()
+    try:
+        token = jwks.mint_token('benchmark|0', ['view:actors'])
+        key = JWKSKeyStore(jwks.url).get_key(jwt.get_unverified_header(token)['kid'])
+        payload = jwt.decode(token, key, algorithms=['RS256'], audience='benchmark', issuer='https://benchmark.local/')
+    finally:
+        jwks.stop()
+    assert payload['permissions'] == ['view:actors']
+
+
+def test_plan_requires_a_scenario_for_every_route():
+    with pytest.raises(ValueError, match='GET /unknown'):
+        plan_requests({('GET', '/'), ('GET', '/unknown')}, Dataset(), 1, None)
+
+
+def test_compare_with_baseline():
+    results = [Result('GET /actors', 200, seconds / 1000, 2) for seconds in range(1, 101)]
+    baseline = summarize(results, 1.0)
+    assert baseline['routes']['GET /actors']['p95_ms'] == 95
+    assert baseline['throughput'] == 100
+    assert compare(baseline, baseline, 0.25) == []
+    slower = summarize([result._replace(seconds=result.seconds * 2, queries=3) for result in results], 2.0)
+    regressions = compare(slower, baseline, 0.25)
+    assert 'GET /actors: p95_ms 190.0 > 95.0 in the baseline' in regressions
+    assert 'GET /actors: 3.0 queries per request > 2.0 in the baseline' in regressions
+    assert 'throughput 50.0 < 100.0 requests/s in the baseline' in regressions
@@ -0,0 +1,52 @@
+from flask import Flask, jsonify
+from cache import LRUCacheBackend, ResponseCache
+
+
+def test_lru_backend_evicts_least_recently_used():
+    backend = LRUCacheBackend(maxsize=2)
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    assert backend.get('a') == b'1'
+    backend.set('c', b'3')
+    assert backend.get('b') is None
+    assert backend.get('a') == b'1'
+    assert backend.get('c') == b'3'
+
+
+def test_lru_backend_evicts_by_total_bytes():
+    backend = LRUCacheBackend(maxsize=10, max_bytes=10)
+    backend.set('a', b'1234')
+    backend.set('b', b'1234')
+    backend.set('a', b'12')
+    assert backend.size_bytes == 6
+    backend.set('c', b'12345')
+    assert backend.get('b') is None
+    assert backend.get('a') == b'12'
+    assert backend.size_bytes == 7
+    # Values larger than the whole cache are not kept
+    backend.set('d', b'12345678901')
+    assert backend.get('d') is None
+    assert backend.size_bytes == 7
+
+
+def test_lru_backend_expires_entries():
+    backend = LRUCacheBackend()
+    backend.set('a', b'1', ttl=-1)
+    assert backend.get('a') is None
+    assert backend.size_bytes == 0
+
+
+def test_response_cache_skips_large_responses():
+    app = Flask(__name__)
+    response_cache = ResponseCache(LRUCacheBackend(), lambda resources: {}, max_entry_bytes=20)
+
+    @app.route('/items/<int:count>')
+    @response_cache.cached('items')
+    def get_items(count):
+        return jsonify(list(range(count)))
+
+    client = app.test_client()
+    assert client.get('/items/3').headers['X-Cache'] == 'MISS'
+    assert client.get('/items/3').headers['X-Cache'] == 'HIT'
+    assert client.get('/items/20').headers['X-Cache'] == 'MISS'
+    assert client.get('/items/20').headers['X-Cache'] == 'MISS'
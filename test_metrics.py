@@ -0,0 +1,48 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine
+from app import create_app
+from models import InstrumentedQueuePool, ReplicaRouter
+
+
+def load_gunicorn_conf(monkeypatch, multiproc_dir):
+    monkeypatch.delenv('prometheus_multiproc_dir', raising=False)
+    if multiproc_dir is None:
+        monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    else:
+        monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(multiproc_dir))
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_child_exit_without_multiprocess_dir(monkeypatch):
+    load_gunicorn_conf(monkeypatch, None).child_exit(None, SimpleNamespace(pid=4242))
+
+
+def test_child_exit_removes_live_gauges_of_the_worker(monkeypatch, tmp_path):
+    (tmp_path / 'gauge_livesum_4242.db').write_bytes(b'')
+    (tmp_path / 'gauge_livesum_4343.db').write_bytes(b'')
+    load_gunicorn_conf(monkeypatch, tmp_path).child_exit(None, SimpleNamespace(pid=4242))
+    assert [f.name for f in tmp_path.iterdir()] == ['gauge_livesum_4343.db']
+
+
+def test_pool_metrics(tmp_path):
+    app = create_app(test_config=True)
+    replica = create_engine(f'sqlite:///{tmp_path}/replica.db', poolclass=InstrumentedQueuePool, pool_size=2)
+    app.replica_router = ReplicaRouter([replica])
+    with replica.connect(), replica.connect():
+        response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    samples = {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+               for family in text_string_to_metric_families(response.get_data(as_text=True))
+               for sample in family.samples if sample.name.startswith('db_pool_')}
+    replica_label = ('database', 'replica_0')
+    assert samples[('db_pool_checkouts_total', (replica_label,))] == 2
+    assert samples[('db_pool_connections', (replica_label, ('state', 'checked_out')))] == 2
+    assert samples[('db_pool_size', (replica_label,))] == 2
+    assert ('db_pool_wait_seconds_total', (replica_label,)) in samples
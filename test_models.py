@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.pool import NullPool
+from models import (Actor, InstrumentedQueuePool, Movie, ReplicaRouter, get_engine_options, redact_parameters,
+                    upsert_statement)
+
+
+def test_engine_options_from_pool_settings():
+    options = get_engine_options('postgresql://localhost/capstone', {'pool_size': 2, 'pool_pre_ping': False})
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == 2
+    assert options['pool_pre_ping'] is False
+    # PgBouncer mode does not keep a pool in the worker
+    assert get_engine_options('postgresql://localhost/capstone', {'pgbouncer': True}) == {'poolclass': NullPool}
+    # SQLite keeps the default pool of the dialect
+    assert get_engine_options('sqlite://', {'pool_size': 2}) == {}
+
+
+def test_instrumented_pool_stats(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool,
+                           pool_size=1, max_overflow=1, pool_timeout=0.1)
+    first = engine.connect()
+    second = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    second.close()
+    first.close()
+    stats = engine.pool.stats()
+    assert stats['checkouts'] == 2
+    assert stats['timeouts'] == 1
+    assert stats['max_overflow_used'] == 1
+    assert stats['checked_out'] == 0
+    assert stats['max_wait_time'] >= 0
+
+
+def test_replica_router_round_robin_skips_unhealthy(tmp_path):
+    engines = [create_engine(f'sqlite:///{tmp_path}/{name}') for name in ('a.db', 'b.db', 'missing/c.db')]
+    router = ReplicaRouter(engines, health_check_interval=60)
+    router.check_all()
+    assert [router.choose() for _ in range(4)] == [engines[0], engines[1], engines[0], engines[1]]
+    router.mark_unhealthy(1)
+    assert router.choose() is engines[0]
+    assert [r['healthy'] for r in router.stats()] == [True, False, False]
+    # Replicas are back in rotation once they pass a check
+    router.check_all()
+    assert [r['healthy'] for r in router.stats()] == [True, True, False]
+
+
+def test_replica_router_least_loaded(tmp_path):
+    # NullPool, e.g. in PgBouncer mode, does not count its connections
+    engines = [create_engine(f'sqlite:///{tmp_path}/{name}', poolclass=NullPool) for name in ('a.db', 'b.db')]
+    router = ReplicaRouter(engines, strategy='least_loaded', health_check_interval=60)
+    assert router.choose() is engines[0]
+    with engines[0].connect():
+        assert router.choose() is engines[1]
+        with engines[1].connect(), engines[1].connect():
+            assert router.choose() is engines[0]
+    assert router.choose() is engines[0]
+
+
+def test_redact_parameters():
+    assert redact_parameters({'name': 'John', 'age': 40}) == {'name': 'str', 'age': 'int'}
+    assert redact_parameters(('John', None)) == ['str', 'NoneType']
+    assert redact_parameters([{'name': 'John'}, {'name': 'Jane'}]) == {'rows': 2, 'first': {'name': 'str'}}
+
+
+def test_upsert_statement():
+    def compile_sql(statement):
+        return str(statement.compile(dialect=postgresql.dialect()))
+
+    # Movies have only natural key columns, the statement must still update the conflicting rows to return them
+    sql = compile_sql(upsert_statement(Movie.__table__, Movie.natural_key,
+                                       [{'title': 'Movie', 'release_date': '2021-01-01'}]))
+    assert 'ON CONFLICT (title, release_date) DO UPDATE SET title = excluded.title' in sql
+    assert sql.endswith('RETURNING movies.id, movies.title, movies.release_date')
+    sql = compile_sql(upsert_statement(Actor.__table__, Actor.natural_key,
+                                       [{'name': 'John', 'age': 40, 'gender': 'male'}]))
+    assert 'DO UPDATE SET age = excluded.age, gender = excluded.gender' in sql
+
+
+def test_search_trigram_indexes():
+    indexes = {index.name: index for model in (Actor, Movie) for index in model.__table__.indexes}
+    sql = str(CreateIndex(indexes['ix_actors_name_trgm']).compile(dialect=postgresql.dialect()))
+    assert sql == 'CREATE INDEX ix_actors_name_trgm ON actors USING gin (name gin_trgm_ops)'
+    sql = str(CreateIndex(indexes['ix_movies_title_trgm']).compile(dialect=postgresql.dialect()))
+    assert sql == 'CREATE INDEX ix_movies_title_trgm ON movies USING gin (title gin_trgm_ops)'
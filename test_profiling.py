@@ -0,0 +1,43 @@
+import os
+from flask import Flask
+from profiling import ProfilerMiddleware, aggregate_profiles
+
+
+def create_profiled_app(directory, sample_rate=0.0, token=None):
+    app = Flask(__name__)
+
+    @app.route('/items/<int:item_id>')
+    def get_item(item_id):
+        return {'id': sum(range(item_id))}
+
+    app.wsgi_app = ProfilerMiddleware(app, str(directory), sample_rate, token)
+    return app
+
+
+def test_profiles_requests_with_token(tmp_path):
+    client = create_profiled_app(tmp_path, token='secret').test_client()
+    res = client.get('/items/1000')
+    assert 'X-Profile-Id' not in res.headers
+    assert os.listdir(tmp_path) == []
+    res = client.get('/items/1000', headers={'X-Profile': 'wrong'})
+    assert 'X-Profile-Id' not in res.headers
+    res = client.get('/items/1000', headers={'X-Profile': 'secret'})
+    assert res.get_json() == {'id': 499500}
+    assert os.listdir(tmp_path) == [f'GET_items_int_item_id.{res.headers["X-Profile-Id"]}.prof']
+
+
+def test_aggregate_profiles_by_route(tmp_path):
+    client = create_profiled_app(tmp_path, sample_rate=1.0).test_client()
+    for item_id in (10, 20, 30):
+        client.get(f'/items/{item_id}')
+    client.get('/missing')
+    report = aggregate_profiles(str(tmp_path), limit=5)
+    assert 'GET_items_int_item_id: 3 profiles' in report
+    assert 'GET_unmatched: 1 profiles' in report
+    with open(tmp_path / 'GET_items_int_item_id.collapsed') as f:
+        lines = f.read().splitlines()
+    assert lines
+    for line in lines:
+        stack, microseconds = line.rsplit(' ', 1)
+        assert int(microseconds) > 0
+    assert any('get_item (test_profiling.py:' in line for line in lines)
@@ -0,0 +1,25 @@
+import datetime as dt
+from models import Actor, Movie, db
+from read_models import ActorRow, MovieRow, fetch_rows, get_row_type, select_rows, stream_rows
+
+
+def test_row_types():
+    assert get_row_type(Actor) is ActorRow
+    assert get_row_type(Movie, ('id', 'title', 'release_date')) is MovieRow
+    row_type = get_row_type(Movie, ('id', 'title'))
+    assert row_type is get_row_type(Movie, ('id', 'title'))
+    assert row_type(1, 'Movie')._asdict() == {'id': 1, 'title': 'Movie'}
+
+
+def test_rows_are_not_added_to_the_session(app, client, executive_producer_jwt):
+    headers = {'authorization': f'Bearer {executive_producer_jwt}'}
+    client.post('/movies/bulk', json=[{'title': f'Movie {i}', 'release_date': '2021-01-01'} for i in range(3)],
+                headers=headers)
+    with app.app_context():
+        statement = select_rows(Movie, MovieRow).order_by(Movie.id)
+        rows = fetch_rows(statement, MovieRow)
+        batches = list(stream_rows(statement, MovieRow, 2))
+        assert len(db.session.identity_map) == 0
+    assert rows[0] == MovieRow(rows[0].id, 'Movie 0', dt.date(2021, 1, 1))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert [row for batch in batches for row in batch] == rows
@@ -0,0 +1,63 @@
+import dataclasses
+import datetime as dt
+import pytest
+from flask import Flask, json
+from metrics import timed
+from serialization import JSONEncoder, OrjsonJSONEncoder, get_json_encoder
+
+
+@dataclasses.dataclass
+class Row:
+    title: str
+    id: int
+
+
+def encode(encoder_class, obj, **kwargs):
+    app = Flask(__name__)
+    app.json_encoder = encoder_class
+    with app.app_context():
+        return json.dumps(obj, **kwargs)
+
+
+@pytest.mark.parametrize('obj', [
+    [{'id': 1, 'title': 'Movie', 'release_date': dt.date(2021, 1, 31)}, {'id': 2, 'title': None}],
+    {'b': [True, False, None], 'a': {'z': 1.5, 'y': -0.25}, 'next': None},
+    [Row('Movie', 1), Row('Movie 2', 2)],
+    # Encoded by the standard library: non ASCII strings, exponents, big integers and keys that aren't strings
+    {'name': 'Zoë', 'quote': '"☃"'},
+    [1e16, 1e-05, -0.000012, 10.00001, 123.0],
+    [2 ** 70],
+    {2: 'two', 1: 'one'}
+])
+@pytest.mark.parametrize('kwargs', [{'separators': (',', ':')}, {'separators': (',', ':'), 'sort_keys': False},
+                                    {'indent': 2}, {}])
+def test_orjson_output_is_identical(obj, kwargs):
+    assert encode(OrjsonJSONEncoder, obj, **kwargs) == encode(JSONEncoder, obj, **kwargs)
+
+
+def test_json_provider():
+    assert get_json_encoder('json') is JSONEncoder
+    assert get_json_encoder('orjson') is OrjsonJSONEncoder
+    with pytest.raises(ValueError):
+        get_json_encoder('simplejson')
+
+
+def test_list_responses_are_identical(app, client, executive_producer_jwt):
+    headers = {'authorization': f'Bearer {executive_producer_jwt}'}
+    client.post('/movies/bulk', json=[{'title': f'Movie {i}', 'release_date': f'20{i:02}-01-01'} for i in range(20)]
+                + [{'title': 'Amélie', 'release_date': '2001-04-25'}], headers=headers)
+    client.post('/actors', json={'name': 'Actor', 'age': 30, 'gender': 'female'}, headers=headers)
+    client.post('/movies/1/actors', json={'actor_ids': [1]}, headers=headers)
+    original_encoder = app.json_encoder
+    responses = {}
+    try:
+        for encoder_class in (JSONEncoder, OrjsonJSONEncoder):
+            app.json_encoder = timed(encoder_class)
+            app.response_cache.clear()
+            responses[encoder_class] = [client.get(path, headers=headers).data
+                                        for path in ('/movies?expand=cast', '/movies?limit=5', '/movies/1',
+                                                     '/movies/1/actors', '/movies?stream=true')]
+    finally:
+        app.json_encoder = original_encoder
+    assert responses[OrjsonJSONEncoder] == responses[JSONEncoder]
+    assert b'"release_date":"2001-04-25"' in responses[JSONEncoder][0]